@@ -0,0 +1,557 @@
+# Copyright (c) 2024 Xavi Burgos
+#
+# Licensed under the MIT License. See LICENSE file in the project root for full
+# license information. Permission is granted to use, copy, modify, and distribute
+# this software for any purpose with or without fee, subject to the above
+# copyright notice and this permission notice.
+
+import os
+import sys
+import time
+import tempfile
+import collections
+import numpy as np
+from timeline import Timeline
+from trajectory import TrajectoryPlayer
+
+CURVES = [
+	(0.25, 0.1, 0.25, 1.0),
+	(0.42, 0.0, 0.58, 1.0),
+	(0.25, 0.0, 0.25, 1.0),
+	(0.9, 0.1, 0.1, 0.9),
+	(0.0, 1.0, 1.0, 0.0)
+]
+
+EASES = {
+	'linear': Timeline.linear,
+	'easeInOut': Timeline.easeInOut,
+	'bezier': Timeline.bezier(0.42, 0.0, 0.58, 1.0),
+	'custom': lambda t: t * t
+}
+
+class FakeSim:
+
+	scripttype_sandbox = 6
+	handle_world = -1
+	intparam_scene_unique_id = 5
+
+	def __init__(self, latency: float = 0.0, record: bool = False):
+		"""Create an in-process sim object that mimics the remote API, without CoppeliaSim
+		Args:
+			latency (float): The simulated round trip of every remote call, in seconds
+			record (bool): If every setpoint should be kept in writes, as (step, kind, handle, value) tuples
+		"""
+		self.latency = latency
+		self.calls = collections.Counter()
+		self.steps = 0
+		self.writes = [] if record else None
+		self.positions = collections.defaultdict(lambda: [0.0, 0.0, 0.0])
+		self.orientations = collections.defaultdict(lambda: [0.0, 0.0, 0.0])
+		self.angles = collections.defaultdict(float)
+		self.quaternions = collections.defaultdict(lambda: [0.0, 0.0, 0.0, 1.0])
+
+	def __call(self, name: str):
+		"""Count a remote call and wait for its simulated latency
+		Args:
+			name (str): The remote function name
+		"""
+		self.calls[name] += 1
+		if self.latency > 0:
+			end = time.perf_counter() + self.latency
+			while time.perf_counter() < end:
+				pass
+
+	def __write(self, kind: str, handle: int, value):
+		"""Store a setpoint, keeping it in the writes when recording
+		Args:
+			kind (str): The setpoint kind, 'position', 'rotation', 'angle' or 'quaternion'
+			handle (int): The object handle
+			value (float | list): The setpoint
+		"""
+		states = {'position': self.positions, 'rotation': self.orientations, 'angle': self.angles, 'quaternion': self.quaternions}
+		states[kind][handle] = value if kind == 'angle' else list(value)
+		if self.writes is not None:
+			self.writes.append((self.steps, kind, handle, states[kind][handle]))
+
+	def reset(self):
+		"""Reset the call counters"""
+		self.calls.clear()
+		self.steps = 0
+
+	def getObjectHandle(self, path: str) -> int:
+		"""Get the handle of an object named like "/Object_<handle>"
+		Args:
+			path (str): The object path
+		Returns:
+			int: The object handle
+		"""
+		self.__call('getObjectHandle')
+		return int(path.strip('/').split('_')[-1])
+
+	def getObjectName(self, handle: int) -> str:
+		"""Get the name of an object
+		Args:
+			handle (int): The object handle
+		Returns:
+			str: The object name, as "Object_<handle>"
+		"""
+		self.__call('getObjectName')
+		return f'Object_{handle}'
+
+	def getInt32Param(self, param: int) -> int:
+		"""Get an integer parameter, which is always 1 (like the scene unique id, since the scene never changes)
+		Args:
+			param (int): The parameter
+		Returns:
+			int: The parameter value
+		"""
+		self.__call('getInt32Param')
+		return 1
+
+	def getObjectPosition(self, handle: int, relative: int = -1) -> list:
+		"""Get the position of an object
+		Args:
+			handle (int): The object handle
+			relative (int): The reference frame, ignored
+		Returns:
+			list: The position [x, y, z]
+		"""
+		self.__call('getObjectPosition')
+		return list(self.positions[handle])
+
+	def getObjectOrientation(self, handle: int, relative: int = -1) -> list:
+		"""Get the orientation of an object
+		Args:
+			handle (int): The object handle
+			relative (int): The reference frame, ignored
+		Returns:
+			list: The Euler angles [x, y, z]
+		"""
+		self.__call('getObjectOrientation')
+		return list(self.orientations[handle])
+
+	def getJointTargetPosition(self, handle: int) -> float:
+		"""Get the target angle of a joint
+		Args:
+			handle (int): The joint handle
+		Returns:
+			float: The target angle
+		"""
+		self.__call('getJointTargetPosition')
+		return self.angles[handle]
+
+	def getObjectQuaternion(self, handle: int, relative: int = -1) -> list:
+		"""Get the quaternion of an object
+		Args:
+			handle (int): The object handle
+			relative (int): The reference frame, ignored
+		Returns:
+			list: The quaternion [x, y, z, w]
+		"""
+		self.__call('getObjectQuaternion')
+		return list(self.quaternions[handle])
+
+	def setObjectPosition(self, handle: int, position: list, relative: int = -1):
+		"""Set the position of an object
+		Args:
+			handle (int): The object handle
+			position (list): The position [x, y, z]
+			relative (int): The reference frame, ignored
+		"""
+		self.__call('setObjectPosition')
+		self.__write('position', handle, position)
+
+	def setObjectOrientation(self, handle: int, orientation: list, relative: int = -1):
+		"""Set the orientation of an object
+		Args:
+			handle (int): The object handle
+			orientation (list): The Euler angles [x, y, z]
+			relative (int): The reference frame, ignored
+		"""
+		self.__call('setObjectOrientation')
+		self.__write('rotation', handle, orientation)
+
+	def setJointTargetPosition(self, handle: int, angle: float):
+		"""Set the target angle of a joint
+		Args:
+			handle (int): The joint handle
+			angle (float): The target angle
+		"""
+		self.__call('setJointTargetPosition')
+		self.__write('angle', handle, angle)
+
+	def setObjectQuaternion(self, handle: int, quaternion: list, relative: int = -1):
+		"""Set the quaternion of an object
+		Args:
+			handle (int): The object handle
+			quaternion (list): The quaternion [x, y, z, w]
+			relative (int): The reference frame, ignored
+		"""
+		self.__call('setObjectQuaternion')
+		self.__write('quaternion', handle, quaternion)
+
+	def setObjectPose(self, handle: int, pose: list, relative: int = -1):
+		"""Set the position and the quaternion of an object
+		Args:
+			handle (int): The object handle
+			pose (list): The pose [x, y, z, qx, qy, qz, qw]
+			relative (int): The reference frame, ignored
+		"""
+		self.__call('setObjectPose')
+		self.__write('position', handle, pose[:3])
+		self.__write('quaternion', handle, pose[3:])
+
+	def step(self):
+		"""Step the simulation, which only counts the steps"""
+		self.__call('step')
+		self.steps += 1
+
+	def getScript(self, type: int) -> int:
+		"""Get the handle of a script
+		Args:
+			type (int): The script type
+		Returns:
+			int: The script handle, always 1
+		"""
+		self.__call('getScript')
+		return 1
+
+	def executeScriptString(self, code: str, script: int):
+		"""Run a script string, which does nothing since the helper functions are implemented in callScriptFunction
+		Args:
+			code (str): The code
+			script (int): The script handle
+		"""
+		self.__call('executeScriptString')
+
+	def callScriptFunction(self, name: str, script: int, *args):
+		"""Run the Python counterpart of a helper function of the coppelia module as a single remote call
+		Args:
+			name (str): The helper function name
+			script (int): The script handle
+		Returns:
+			any: The helper function result
+		"""
+		self.__call(name)
+		if name == 'coppeliaGetHandles':
+			return [int(path.strip('/').split('_')[-1]) for path in args[0]], 1
+		if name == 'coppeliaGetNames':
+			return [f'Object_{handle}' for handle in args[0]], 1
+		if name == 'coppeliaApply':
+			handles, kinds, values = args[:3]
+			for handle, kind, value in zip(handles, kinds, values):
+				if kind == 4:
+					self.__write('position', handle, value[:3])
+					self.__write('quaternion', handle, value[3:])
+				else:
+					self.__write(('position', 'rotation', 'angle', 'quaternion')[kind], handle, value)
+			if len(args) == 3:
+				return []
+			readers = (self.positions, self.orientations, self.angles, self.quaternions)
+			return [readers[kind][handle] if kind == 2 else list(readers[kind][handle]) for handle, kind in zip(args[3], args[4])]
+		raise Exception(f'"{name}" is not a helper function')
+
+def buildTimeline(sim: FakeSim, events: int, duration: float, ease, yoyo: bool = False, batch: bool = False, targets: int = 16) -> Timeline:
+	"""Build a timeline of back to back movements over a group of targets, alternating joint angles and positions
+	Args:
+		sim (FakeSim): The sim object
+		events (int): The number of movements
+		duration (float): The duration of every movement
+		ease (function): The ease function
+		yoyo (bool): If the timeline should yoyo
+		batch (bool): If the setpoints should be batched
+		targets (int): The number of targets moving at the same time
+	Returns:
+		Timeline: The timeline object
+	"""
+	tl = Timeline(sim, {'default': {'duration': duration, 'ease': ease}, 'yoyo': yoyo, 'batch': batch})
+	targets = min(targets, events)
+	for i in range(events):
+		target = i % targets
+		vars = {'angle': (i % 7) * 0.1} if target % 2 == 0 else {'position': [i * 0.01, 0.0, 0.1]}
+		tl.to(target, vars, (i // targets) * duration)
+	return tl
+
+def benchmarkTimeline(events: list = [16, 256, 4096], durations: list = [0.25, 1.0], eases: list = list(EASES), latency: float = 0.0):
+	"""Measure the build time, the playback speed and the remote calls per step of the timeline on a fake sim
+	Args:
+		events (list): The numbers of movements
+		durations (list): The durations of every movement
+		eases (list): The names of the ease functions (see EASES)
+		latency (float): The simulated round trip of every remote call, in seconds
+	"""
+	print(f'Timeline: {latency * 1e6:.0f} us of simulated latency per remote call')
+	print(f'{"events":>8}{"duration":>10}{"ease":>12}{"yoyo":>6}{"batch":>7}{"to (us)":>10}{"steps/s":>12}{"calls/step":>12}')
+	for n in events:
+		for duration in durations:
+			for ease in eases:
+				for yoyo in (False, True):
+					for batch in (False, True):
+						sim = FakeSim(latency)
+						start = time.perf_counter()
+						tl = buildTimeline(sim, n, duration, EASES[ease], yoyo, batch)
+						build = (time.perf_counter() - start) / n
+						sim.reset()
+						start = time.perf_counter()
+						tl.play()
+						elapsed = time.perf_counter() - start
+						calls = sum(sim.calls.values())
+						print(f'{n:>8}{duration:>10}{ease:>12}{str(yoyo):>6}{str(batch):>7}{build * 1e6:>10.1f}{sim.steps / elapsed:>12.0f}{calls / sim.steps:>12.2f}')
+
+def checkTrajectory(rates: list = [0.5, 1, 3, 7, 13]):
+	"""Check that the playback of a rendered trajectory ends on its last row for every rate
+	Args:
+		rates (list): The playback rates
+	"""
+	sim = FakeSim()
+	tl = Timeline(sim, {'default': {'duration': 0.5, 'ease': Timeline.easeInOut}})
+	tl.to(1, {'angle': 1.0})
+	tl.to(2, {'position': [0.3, -0.2, 0.1]})
+	tl.to(3, {'quaternion': [0.0, 0.0, 0.7071067811865476, 0.7071067811865476]}, 0.25)
+	snapshot = tl.snapshot()
+	with tempfile.TemporaryDirectory() as directory:
+		path = os.path.join(directory, 'check.trj')
+		tl.render(path, snapshot)
+		print('Trajectory: final state against the last row')
+		print(f'{"rate":>8}{"steps":>8}{"max error":>12}')
+		for rate in rates:
+			sim = FakeSim()
+			player = TrajectoryPlayer(sim, path, {'rate': rate})
+			player.play()
+			readers = {'position': sim.positions, 'rotation': sim.orientations, 'angle': sim.angles, 'quaternion': sim.quaternions}
+			last = player.trajectory.data[-1]
+			error = 0.0
+			for c in player.trajectory.channels:
+				expected = last[c['column']:c['column'] + c['size']]
+				error = max(error, float(np.abs(np.asarray(readers[c['kind']][c['handle']], dtype=float) - expected).max()))
+			del player
+			print(f'{rate:>8}{sim.steps:>8}{error:>12.2e}')
+			if error != 0.0:
+				raise Exception(f'Playback at rate {rate} does not end on the last row of the trajectory')
+
+def expect(condition: bool, message: str):
+	"""Fail a check
+	Args:
+		condition (bool): The checked condition
+		message (str): The error message if the condition is false
+	"""
+	if not condition:
+		raise Exception(message)
+
+def angles(sim: FakeSim, handle: int) -> dict:
+	"""Get the angles written to a joint, by step
+	Args:
+		sim (FakeSim): The recording sim object
+		handle (int): The joint handle
+	Returns:
+		dict: The written angles, as {step: angle}
+	"""
+	return {step: value for step, kind, h, value in sim.writes if kind == 'angle' and h == handle}
+
+def checkSteps():
+	"""Check the quantized step semantics: an event from step s to step e writes from s + 1 to e, ending exactly
+	on its final value, and an event without duration writes its final value on its start step
+	"""
+	sim = FakeSim(record=True)
+	tl = Timeline(sim, {'default': {'ease': Timeline.easeInOut}})
+	tl.to(1, {'angle': 1.0, 'duration': 0.25}, 0.1)
+	tl.to(2, {'angle': 0.3, 'duration': 0}, 0.5)
+	tl.to(3, {'angle': 0.7, 'duration': 0.1}, 0.0021)
+	tl.play()
+	written = angles(sim, 1)
+	expect(sorted(written) == list(range(25, 85)), 'An event from step 24 to step 84 must write on steps 25 to 84')
+	expect(written[84] == 1.0, 'An event must end exactly on its final value')
+	expect(angles(sim, 2) == {120: 0.3}, 'An event without duration must write its final value once, on its start step')
+	written = angles(sim, 3)
+	expect(sorted(written) == list(range(2, 26)) and written[25] == 0.7, 'The times of an event must be rounded to the nearest step')
+	print('Steps: ok')
+
+def checkOverlaps():
+	"""Check that overlapping animations of the same target are rejected, and that add_many inserts nothing when one of them overlaps"""
+	tl = Timeline(None, {'default': {'duration': 1.0}})
+	tl.to(1, {'angle': 1.0}, 0)
+	tl.to(1, {'angle': 0.0}, 1.0)
+	tl.to(2, {'angle': 1.0}, 0.5)
+	for position in (0.5, 0.0, 1.5, 1.99):
+		try:
+			tl.to(1, {'angle': 0.5}, position)
+		except Exception:
+			continue
+		raise Exception(f'An animation at {position} must overlap with the animations of the same target')
+	for tweens in ([(3, {'angle': 1.0}, 0), (1, {'angle': 1.0}, 1.5)], [(3, {'angle': 1.0}, 0), (3, {'angle': 0.5}, 0.5)]):
+		try:
+			tl.add_many(tweens)
+		except Exception:
+			continue
+		raise Exception('add_many must reject overlapping animations')
+	tl.to(3, {'angle': 1.0}, 0)
+	tl.to(1, {'angle': 0.5}, 2.0)
+	tl.to(2, {'angle': 0.0})
+	expect(tl.compile() is tl, 'The timeline must compile after the rejected animations')
+	print('Overlaps: ok')
+
+def checkPaths():
+	"""Check that paths go through their waypoints at their times and end exactly on the last one, with both splines"""
+	waypoints = [0.5, -0.2, 1.0]
+	for spline in ('catmull-rom', 'cubic'):
+		sim = FakeSim(record=True)
+		tl = Timeline(sim, {'default': {'duration': 1.0, 'ease': Timeline.linear}})
+		tl.to(1, {'angle': waypoints, 'spline': spline}, 0)
+		tl.to(2, {'angle': waypoints, 'spline': spline, 'times': [0.25, 0.5, 1]}, 0)
+		tl.play()
+		for handle, steps in ((1, (80, 160, 240)), (2, (60, 120, 240))):
+			written = angles(sim, handle)
+			for step, waypoint in zip(steps, waypoints):
+				expect(abs(written[step] - waypoint) < 1e-9, f'A {spline} path must reach its waypoint {waypoint} on step {step}')
+			expect(written[240] == 1.0, f'A {spline} path must end exactly on its last waypoint')
+	print('Paths: ok')
+
+def checkYoyo():
+	"""Check that the reversed half of a yoyo timeline writes the values of the original half backwards, ending on the initial state"""
+	sim = FakeSim(record=True)
+	sim.angles[1] = 0.2
+	tl = Timeline(sim, {'default': {'duration': 0.25, 'ease': Timeline.bezier(0.42, 0.0, 0.58, 1.0)}, 'yoyo': True})
+	tl.to(1, {'angle': 1.0}, 0)
+	tl.to(2, {'position': [0.1, 0.2, 0.3]}, 0.1)
+	tl.play()
+	written = angles(sim, 1)
+	expect(sorted(written) == list(range(1, 61)) + list(range(109, 169)), 'An event from step 0 to step 60 of an 84 step yoyo timeline must be reversed from step 108 to step 168')
+	for step in range(1, 60):
+		expect(written[168 - step] == written[step], f'The reversed half must mirror step {step}')
+	expect(written[168] == 0.2 and sim.positions[2] == [0.0, 0.0, 0.0], 'A yoyo timeline must end exactly on the initial state')
+	print('Yoyo: ok')
+
+def checkTolerance(tolerance: float = 0.001):
+	"""Check that with a tolerance the simulation never differs from the computed setpoints by more than the tolerance,
+	in both halves of a yoyo timeline, and that the final value is always written
+	Args:
+		tolerance (float): The angle tolerance
+	"""
+	runs = []
+	for options in ({}, {'tolerance': {'angle': tolerance}}):
+		sim = FakeSim(record=True)
+		tl = Timeline(sim, {'default': {'duration': 2.0, 'ease': Timeline.easeInOut}, 'yoyo': True, **options})
+		tl.to(1, {'angle': 0.1005}, 0)
+		tl.play()
+		runs.append(angles(sim, 1))
+	exact, skipped = runs
+	current = 0.0
+	for step in sorted(exact):
+		current = skipped.get(step, current)
+		expect(abs(current - exact[step]) <= tolerance, f'Step {step} differs from its setpoint by more than the tolerance')
+	expect(skipped[max(exact)] == exact[max(exact)] and skipped[480] == 0.1005, 'The final value of every half must be written')
+	expect(481 not in skipped, 'The first step of the reversed half must be compared with the value it starts from')
+	expect(len(skipped) < len(exact) / 2, 'A tolerance of 1 mrad must skip most of the writes of a 0.1 rad movement')
+	print(f'Tolerance: ok, {len(skipped)} of {len(exact)} writes')
+
+def legacyCubicBezier(t: float, p1x: float, p1y: float, p2x: float, p2y: float) -> float:
+	"""The original cubicBezier function, kept as a baseline
+	Args:
+		t (float): The time (0 to 1)
+		p1x (float): The first control point x
+		p1y (float): The first control point y
+		p2x (float): The second control point x
+		p2y (float): The second control point y
+	Returns:
+		float: The eased time
+	"""
+	cx = 3.0 * p1x
+	bx = 3.0 * (p2x - p1x) - cx
+	ax = 1.0 - cx - bx
+	cy = 3.0 * p1y
+	by = 3.0 * (p2y - p1y) - cy
+	ay = 1.0 - cy - by
+	def sampleCurveX(t):
+		return ((ax * t + bx) * t + cx) * t
+	def sampleCurveY(t):
+		return ((ay * t + by) * t + cy) * t
+	def sampleCurveDerivativeX(t):
+		return (3.0 * ax * t + 2.0 * bx) * t + cx
+	def solveCurveX(x):
+		t2 = x
+		for _ in range(8):
+			x2 = sampleCurveX(t2) - x
+			if abs(x2) < 1e-3:
+				return t2
+			d2 = sampleCurveDerivativeX(t2)
+			if abs(d2) < 1e-3:
+				break
+			t2 = t2 - x2 / d2
+		return t2
+	return sampleCurveY(solveCurveX(t))
+
+def referenceCubicBezier(t: np.ndarray, p1x: float, p1y: float, p2x: float, p2y: float) -> np.ndarray:
+	"""Solve the cubicBezier curve by plain bisection, used as the accuracy reference
+	Args:
+		t (np.ndarray): The times (0 to 1)
+		p1x (float): The first control point x
+		p1y (float): The first control point y
+		p2x (float): The second control point x
+		p2y (float): The second control point y
+	Returns:
+		np.ndarray: The eased times
+	"""
+	low = np.zeros(len(t))
+	high = np.ones(len(t))
+	for _ in range(60):
+		u = (low + high) * 0.5
+		x = 3 * (1 - u) ** 2 * u * p1x + 3 * (1 - u) * u ** 2 * p2x + u ** 3
+		low = np.where(x < t, u, low)
+		high = np.where(x < t, high, u)
+	u = (low + high) * 0.5
+	return 3 * (1 - u) ** 2 * u * p1y + 3 * (1 - u) * u ** 2 * p2y + u ** 3
+
+def measure(function, repeat: int = 5) -> float:
+	"""Measure the best execution time of a function
+	Args:
+		function (function): The function to measure
+		repeat (int): The number of repetitions
+	Returns:
+		float: The best time in seconds
+	"""
+	best = float('inf')
+	for _ in range(repeat):
+		start = time.perf_counter()
+		function()
+		best = min(best, time.perf_counter() - start)
+	return best
+
+def benchmarkBezier(samples: int = 10000):
+	"""Compare the accuracy and speed of the cubicBezier implementations
+	Args:
+		samples (int): The number of times evaluated per curve
+	"""
+	t = np.linspace(0, 1, samples)
+	ts = t.tolist()
+	print(f'cubicBezier: {samples} samples per curve')
+	print(f'{"curve":<28}{"method":<16}{"max error":>12}{"time (ms)":>12}')
+	for curve in CURVES:
+		reference = referenceCubicBezier(t, *curve)
+		ease = Timeline.bezier(*curve)
+		table = Timeline.bezier(*curve, samples=1024)
+		methods = [
+			('legacy', lambda: [legacyCubicBezier(x, *curve) for x in ts]),
+			('cubicBezier', lambda: [Timeline.cubicBezier(x, *curve) for x in ts]),
+			('bezier', lambda: [ease(x) for x in ts]),
+			('bezier (lut)', lambda: [table(x) for x in ts]),
+			('bezier.array', lambda: ease.array(t)),
+			('lut.array', lambda: table.array(t))
+		]
+		for name, function in methods:
+			error = np.abs(np.asarray(function(), dtype=float) - reference).max()
+			elapsed = measure(function) * 1000
+			print(f'{str(curve):<28}{name:<16}{error:>12.2e}{elapsed:>12.3f}')
+
+if __name__ == '__main__':
+	if len(sys.argv) < 2 or sys.argv[1] == 'bezier':
+		benchmarkBezier()
+	if len(sys.argv) < 2 or sys.argv[1] == 'timeline':
+		benchmarkTimeline(latency=float(sys.argv[2]) / 1e6 if len(sys.argv) > 2 else 0.0)
+	if len(sys.argv) < 2 or sys.argv[1] == 'check':
+		checkSteps()
+		checkOverlaps()
+		checkPaths()
+		checkYoyo()
+		checkTolerance()
+	if len(sys.argv) < 2 or sys.argv[1] == 'trajectory':
+		checkTrajectory()
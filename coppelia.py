@@ -6,37 +6,757 @@
 # copyright notice and this permission notice.
 
 import math
+import time
+import queue
+import asyncio
+import weakref
+import contextlib
+import collections
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from coppeliasim_zmqremoteapi_client import RemoteAPIClient
 
 coppelia_client = None
 coppelia_sim = None
 
-def connect():
+_HELPER = '''
+function coppeliaApply(handles, kinds, values, readHandles, readKinds)
+	for i = 1, #handles do
+		local kind = kinds[i]
+		if kind == 0 then
+			sim.setObjectPosition(handles[i], values[i], sim.handle_world)
+		elseif kind == 1 then
+			sim.setObjectOrientation(handles[i], values[i], sim.handle_world)
+		elseif kind == 2 then
+			sim.setJointTargetPosition(handles[i], values[i])
+		elseif kind == 3 then
+			sim.setObjectQuaternion(handles[i], values[i], sim.handle_world)
+		else
+			sim.setObjectPose(handles[i], values[i], sim.handle_world)
+		end
+	end
+	local states = {}
+	if readHandles ~= nil then
+		for i = 1, #readHandles do
+			local kind = readKinds[i]
+			if kind == 0 then
+				states[i] = sim.getObjectPosition(readHandles[i], sim.handle_world)
+			elseif kind == 1 then
+				states[i] = sim.getObjectOrientation(readHandles[i], sim.handle_world)
+			elseif kind == 2 then
+				states[i] = sim.getJointTargetPosition(readHandles[i])
+			else
+				states[i] = sim.getObjectQuaternion(readHandles[i], sim.handle_world)
+			end
+		end
+	end
+	return states
+end
+
+function coppeliaWaitHook()
+	if coppeliaWaitSteps == nil then
+		return
+	end
+	coppeliaWaitSteps = coppeliaWaitSteps - 1
+	if coppeliaWaitCondition ~= nil and coppeliaWaitCondition() then
+		coppeliaWaitResult = 2
+	elseif coppeliaWaitSteps <= 0 then
+		coppeliaWaitResult = 1
+	else
+		return
+	end
+	coppeliaWaitSteps = nil
+	sim.pauseSimulation()
+end
+
+if coppeliaHelperLoaded == nil then
+	coppeliaHelperLoaded = true
+	coppeliaWaitSteps = nil
+	coppeliaWaitCondition = nil
+	coppeliaWaitResult = 0
+	sim.registerScriptFuncHook('sysCall_sensing', 'coppeliaWaitHook', false)
+end
+
+function coppeliaWait(steps, condition)
+	local compiled = nil
+	if condition ~= '' then
+		local err
+		compiled, err = load('return ' .. condition)
+		if compiled == nil then
+			return err
+		end
+	end
+	coppeliaWaitSteps = steps
+	coppeliaWaitCondition = compiled
+	coppeliaWaitResult = 0
+	return ''
+end
+
+function coppeliaWaitCancel()
+	coppeliaWaitSteps = nil
+	coppeliaWaitCondition = nil
+end
+
+function coppeliaWaitState()
+	return sim.getSimulationState(), coppeliaWaitResult
+end
+
+function coppeliaGetHandles(paths)
+	local handles = {}
+	for i = 1, #paths do
+		handles[i] = sim.getObjectHandle(paths[i])
+	end
+	return handles, sim.getInt32Param(sim.intparam_scene_unique_id)
+end
+
+function coppeliaGetNames(handles)
+	local names = {}
+	for i = 1, #handles do
+		names[i] = sim.getObjectName(handles[i])
+	end
+	return names, sim.getInt32Param(sim.intparam_scene_unique_id)
+end
+'''
+_helpers = weakref.WeakKeyDictionary()
+_caches = weakref.WeakKeyDictionary()
+
+KIND_POSITION = 0
+KIND_ORIENTATION = 1
+KIND_ANGLE = 2
+KIND_QUATERNION = 3
+KIND_POSE = 4
+
+def _open(host: str, port: int, stepping: bool = True) -> tuple:
+	"""Open a new connection to CoppeliaSim, in stepping mode by default
+	Args:
+		host (str): The host of the CoppeliaSim server
+		port (int): The port of the CoppeliaSim server
+		stepping (bool): If the connection should step the simulation, otherwise it only reads and writes
+	Returns:
+		tuple: The sim and client objects
+	"""
+	client = RemoteAPIClient(host, port)
+	sim = client.require('sim')
+	if stepping:
+		sim.setStepping(True)
+	return sim, client
+
+def connect(host: str = 'localhost', port: int = 23000):
 	"""Connect to CoppeliaSim via the Remote API
+	Args:
+		host (str): The host of the CoppeliaSim server
+		port (int): The port of the CoppeliaSim server
 	Returns:
 		RemoteAPIClient: The client object
 		RemoteAPIServer: The sim object
 	"""
 	global coppelia_client, coppelia_sim
-	client = RemoteAPIClient()
-	sim = client.require('sim')
-	sim.setStepping(True)
+	sim, client = _open(host, port)
 	coppelia_sim = sim
 	coppelia_client = client
 	return sim, client
 
-def wait(duration: float, steps_per_second: int = 240):
+def _installHelper(sim) -> int:
+	"""Install the Lua helper functions in the sandbox script.
+	The sandbox script outlives the connections, so running the helper again only redefines its functions:
+	the wait state and the sensing hook are set up once per server.
+	Args:
+		sim (RemoteAPIServer): The sim object
+	Returns:
+		int: The sandbox script handle where the helper lives
+	"""
+	if isinstance(sim, AsyncSim):
+		return sim.client.blocking(_installHelper, sim.sync)
+	if sim in _helpers:
+		return _helpers[sim]
+	script = sim.getScript(sim.scripttype_sandbox)
+	sim.executeScriptString(_HELPER + '@lua', script)
+	_helpers[sim] = script
+	return script
+
+def _cache(sim, scene: int = None) -> dict:
+	"""Get the handle and name cache of a sim object, clearing it when a remote lookup reports another scene
+	Args:
+		sim (RemoteAPIServer): The sim object
+		scene (int): The scene unique id returned by a remote lookup, if any
+	Returns:
+		dict: The cache, as {'scene': id, 'handles': {path: handle}, 'names': {handle: name}}
+	"""
+	if sim not in _caches:
+		_caches[sim] = {'scene': scene, 'handles': {}, 'names': {}}
+	cache = _caches[sim]
+	if scene is not None and cache['scene'] != scene:
+		cache['scene'] = scene
+		cache['handles'].clear()
+		cache['names'].clear()
+	return cache
+
+def _simOrDefault(sim):
+	"""Get the given sim object or the connected one
+	Args:
+		sim (RemoteAPIServer): The sim object, or None
+	Returns:
+		RemoteAPIServer: The sim object
+	"""
+	if sim is not None:
+		return sim
+	if coppelia_sim is None:
+		raise Exception("Not connected to CoppeliaSim, call \"coppelia_connect()\" first.")
+	return coppelia_sim
+
+def getObjectHandles(paths: list, sim = None) -> list:
+	"""Get the handles of several objects, resolving the ones not cached in a single remote call.
+	Cached handles are returned without any remote call, so they are not checked against the current scene:
+	call invalidate after loading, closing or editing the scene. The scene is only compared on a cache miss.
+	Args:
+		paths (list): The object paths or names
+		sim (RemoteAPIServer): The sim object, by default the connected one
+	Returns:
+		list: The object handles
+	"""
+	sim = _simOrDefault(sim)
+	if isinstance(sim, AsyncSim):
+		return sim.client.blocking(getObjectHandles, paths, sim.sync)
+	handles = _cache(sim)['handles']
+	missing = list(dict.fromkeys(path for path in paths if path not in handles))
+	if len(missing) > 0:
+		resolved, scene = sim.callScriptFunction('coppeliaGetHandles', _installHelper(sim), missing)
+		handles = _cache(sim, scene)['handles']
+		handles.update(zip(missing, resolved))
+		missing = [path for path in paths if path not in handles]
+		if len(missing) > 0:
+			return getObjectHandles(paths, sim)
+	return [handles[path] for path in paths]
+
+def getObjectHandle(path: str, sim = None) -> int:
+	"""Get the handle of an object, using the cache.
+	A cached handle is not checked against the current scene: call invalidate after loading, closing or editing the scene.
+	Args:
+		path (str): The object path or name
+		sim (RemoteAPIServer): The sim object, by default the connected one
+	Returns:
+		int: The object handle
+	"""
+	return getObjectHandles([path], sim)[0]
+
+def getObjectNames(handles: list, sim = None) -> list:
+	"""Get the names of several objects, resolving the ones not cached in a single remote call.
+	Cached names are not checked against the current scene (see getObjectHandles).
+	Args:
+		handles (list): The object handles
+		sim (RemoteAPIServer): The sim object, by default the connected one
+	Returns:
+		list: The object names
+	"""
+	sim = _simOrDefault(sim)
+	if isinstance(sim, AsyncSim):
+		return sim.client.blocking(getObjectNames, handles, sim.sync)
+	names = _cache(sim)['names']
+	missing = list(dict.fromkeys(handle for handle in handles if handle not in names))
+	if len(missing) > 0:
+		resolved, scene = sim.callScriptFunction('coppeliaGetNames', _installHelper(sim), missing)
+		names = _cache(sim, scene)['names']
+		names.update(zip(missing, resolved))
+		missing = [handle for handle in handles if handle not in names]
+		if len(missing) > 0:
+			return getObjectNames(handles, sim)
+	return [names[handle] for handle in handles]
+
+def getObjectName(handle: int, sim = None) -> str:
+	"""Get the name of an object, using the cache.
+	A cached name is not checked against the current scene (see getObjectHandles).
+	Args:
+		handle (int): The object handle
+		sim (RemoteAPIServer): The sim object, by default the connected one
+	Returns:
+		str: The object name
+	"""
+	return getObjectNames([handle], sim)[0]
+
+def invalidate(sim = None):
+	"""Clear the handle and name cache. Required after loading, closing or editing the scene, since cache hits are not validated
+	Args:
+		sim (RemoteAPIServer): The sim object, by default the connected one
+	"""
+	sim = _simOrDefault(sim)
+	if isinstance(sim, AsyncSim):
+		sim = sim.sync
+	if sim in _caches:
+		del _caches[sim]
+
+def getStates(requests: list, sim = None):
+	"""Read several object states, in a single remote call when using a Batch
+	Args:
+		requests (list): The states to read, as (handle, kind) tuples, where kind is KIND_POSITION, KIND_ORIENTATION, KIND_ANGLE or KIND_QUATERNION
+		sim (RemoteAPIServer | Batch): The sim object or batch, by default the connected sim
+	Returns:
+		list: The state of each request
+	"""
+	sim = _simOrDefault(sim)
+	if isinstance(sim, Batch):
+		return sim.getStates(requests)
+	getters = ('getObjectPosition', 'getObjectOrientation', 'getJointTargetPosition', 'getObjectQuaternion')
+	return [getattr(sim, getters[kind])(handle) for handle, kind in requests]
+
+class Batch:
+
+	def __init__(self, sim):
+		"""Create a write batch that sends all the setpoints of a step at once
+		Args:
+			sim (RemoteAPIServer): The sim object
+		"""
+		self._sim = sim
+		self.__script = _installHelper(sim)
+		self.__handles = []
+		self.__kinds = []
+		self.__values = []
+
+	def setObjectPosition(self, handle: int, position: list):
+		"""Queue the position of an object
+		Args:
+			handle (int): The object handle
+			position (list): The position [x, y, z]
+		"""
+		self.__handles.append(handle)
+		self.__kinds.append(KIND_POSITION)
+		self.__values.append(position)
+
+	def setObjectOrientation(self, handle: int, orientation: list):
+		"""Queue the orientation of an object
+		Args:
+			handle (int): The object handle
+			orientation (list): The Euler angles [alpha, beta, gamma]
+		"""
+		self.__handles.append(handle)
+		self.__kinds.append(KIND_ORIENTATION)
+		self.__values.append(orientation)
+
+	def setJointTargetPosition(self, handle: int, angle: float):
+		"""Queue the target position of a joint
+		Args:
+			handle (int): The joint handle
+			angle (float): The target position
+		"""
+		self.__handles.append(handle)
+		self.__kinds.append(KIND_ANGLE)
+		self.__values.append(angle)
+
+	def setObjectQuaternion(self, handle: int, quaternion: list):
+		"""Queue the orientation of an object as a quaternion
+		Args:
+			handle (int): The object handle
+			quaternion (list): The quaternion [x, y, z, w]
+		"""
+		self.__handles.append(handle)
+		self.__kinds.append(KIND_QUATERNION)
+		self.__values.append(quaternion)
+
+	def setObjectPose(self, handle: int, pose: list):
+		"""Queue the position and the orientation of an object
+		Args:
+			handle (int): The object handle
+			pose (list): The pose [x, y, z, qx, qy, qz, qw]
+		"""
+		self.__handles.append(handle)
+		self.__kinds.append(KIND_POSE)
+		self.__values.append(pose)
+
+	def getStates(self, requests: list):
+		"""Send all the queued setpoints and read several object states in a single remote call
+		Args:
+			requests (list): The states to read, as (handle, kind) tuples
+		Returns:
+			list: The state of each request
+		"""
+		readHandles = [request[0] for request in requests]
+		readKinds = [request[1] for request in requests]
+		states = self._sim.callScriptFunction('coppeliaApply', self.__script, self.__handles, self.__kinds, self.__values, readHandles, readKinds)
+		self.__handles = []
+		self.__kinds = []
+		self.__values = []
+		return states
+
+	def flush(self):
+		"""Send all the queued setpoints in a single remote call"""
+		if len(self.__handles) == 0:
+			return
+		self._sim.callScriptFunction('coppeliaApply', self.__script, self.__handles, self.__kinds, self.__values)
+		self.__handles = []
+		self.__kinds = []
+		self.__values = []
+
+	def step(self):
+		"""Flush the queued setpoints and step the simulation"""
+		self.flush()
+		self._sim.step()
+
+class Lockstep:
+
+	def __init__(self, writer, barrier, substeps: int = 1, owner: bool = False):
+		"""Wrap a sim object or batch so several processes writing to the same simulation keep in step. Every written step
+		waits until all the processes have sent their setpoints, and only the owner steps the simulation
+		Args:
+			writer (RemoteAPIServer | Batch): The sim object or batch used to write the setpoints
+			barrier (multiprocessing.Barrier): The barrier shared by all the processes
+			substeps (int): The number of simulation steps of every written step
+			owner (bool): If this process steps the simulation
+		"""
+		self.writer = writer
+		self.barrier = barrier
+		self.substeps = substeps
+		self.owner = owner
+		self.__substep = 0
+
+	def __getattr__(self, name: str):
+		"""Get a function of the wrapped sim object or batch
+		Args:
+			name (str): The attribute name
+		Returns:
+			any: The attribute
+		"""
+		attr = getattr(self.writer, name)
+		setattr(self, name, attr)
+		return attr
+
+	def step(self):
+		"""Wait until every process has sent its setpoints, then step the simulation if this is the owner.
+		After the last simulation step of a written step, wait until the owner has stepped it"""
+		if self.__substep == 0:
+			if isinstance(self.writer, Batch):
+				self.writer.flush()
+			self.barrier.wait()
+		if self.owner:
+			self.writer.step()
+		self.__substep += 1
+		if self.__substep == self.substeps:
+			self.__substep = 0
+			self.barrier.wait()
+
+class AsyncClient:
+
+	def __init__(self, host: str = 'localhost', port: int = 23000, pipeline: int = 4):
+		"""Create an asynchronous client, running the remote calls in order on a dedicated thread
+		Args:
+			host (str): The host of the CoppeliaSim server
+			port (int): The port of the CoppeliaSim server
+			pipeline (int): The maximum number of remote calls in flight
+		"""
+		if type(pipeline) != int or pipeline < 1:
+			raise Exception('"pipeline" must be an integer greater than 0')
+		self.pipeline = pipeline
+		self.__executor = ThreadPoolExecutor(max_workers=1)
+		self.__pending = collections.deque()
+		self.client = self.blocking(RemoteAPIClient, host, port)
+
+	def blocking(self, function, *args):
+		"""Run a function on the client thread and wait for its result
+		Args:
+			function (function): The function to run
+			*args: The function arguments
+		Returns:
+			any: The function result
+		"""
+		return self.__executor.submit(function, *args).result()
+
+	def submit(self, function, *args) -> asyncio.Future:
+		"""Queue a function on the client thread without waiting for it
+		Args:
+			function (function): The function to run
+			*args: The function arguments
+		Returns:
+			asyncio.Future: The future of the function result
+		"""
+		future = asyncio.get_running_loop().run_in_executor(self.__executor, function, *args)
+		self.__pending.append(future)
+		return future
+
+	async def throttle(self):
+		"""Wait until the number of remote calls in flight is within the pipeline limit"""
+		pending = self.__pending
+		while pending and pending[0].done():
+			await pending.popleft()
+		while len(pending) > self.pipeline:
+			await pending.popleft()
+
+	async def drain(self):
+		"""Wait until all the remote calls in flight are completed"""
+		while self.__pending:
+			await self.__pending.popleft()
+
+	async def require(self, name: str) -> 'AsyncSim':
+		"""Get an asynchronous proxy of a remote object
+		Args:
+			name (str): The remote object name, like 'sim'
+		Returns:
+			AsyncSim: The asynchronous proxy
+		"""
+		return AsyncSim(self, await self.submit(self.client.require, name))
+
+class AsyncSim:
+
+	def __init__(self, client: AsyncClient, sim):
+		"""Create an asynchronous proxy of a remote object, where every function returns a future
+		Args:
+			client (AsyncClient): The asynchronous client
+			sim (RemoteAPIServer): The synchronous remote object
+		"""
+		self.client = client
+		self.sync = sim
+
+	def __getattr__(self, name: str):
+		"""Get a constant or an asynchronous function of the remote object
+		Args:
+			name (str): The attribute name
+		Returns:
+			any: The constant, or a function returning a future
+		"""
+		attr = getattr(self.sync, name)
+		if not callable(attr):
+			return attr
+		submit = self.client.submit
+		function = lambda *args: submit(attr, *args)
+		setattr(self, name, function)
+		return function
+
+async def connect_async(host: str = 'localhost', port: int = 23000, pipeline: int = 4):
+	"""Connect to CoppeliaSim via the Remote API for asynchronous use
+	Args:
+		host (str): The host of the CoppeliaSim server
+		port (int): The port of the CoppeliaSim server
+		pipeline (int): The maximum number of remote calls in flight
+	Returns:
+		AsyncSim: The asynchronous sim object
+		AsyncClient: The asynchronous client object
+	"""
+	loop = asyncio.get_running_loop()
+	client = await loop.run_in_executor(None, AsyncClient, host, port, pipeline)
+	sim = await client.require('sim')
+	await sim.setStepping(True)
+	return sim, client
+
+class Pool:
+
+	def __init__(self, ports: list, host: str = 'localhost'):
+		"""Create a pool of connections to several CoppeliaSim instances, opened on first use
+		Args:
+			ports (list): The ports of the CoppeliaSim servers
+			host (str): The host of the CoppeliaSim servers
+		"""
+		if type(ports) != list or len(ports) == 0:
+			raise Exception('"ports" must be a non-empty list')
+		self.host = host
+		self.ports = ports
+		self.__available = queue.Queue()
+		for port in ports:
+			self.__available.put((port, None))
+		self.__ports = {}
+
+	@property
+	def size(self) -> int:
+		"""The number of CoppeliaSim instances of the pool"""
+		return len(self.ports)
+
+	def acquire(self):
+		"""Take a sim object from the pool, waiting until one is available
+		Returns:
+			RemoteAPIServer: The sim object
+		"""
+		port, connection = self.__available.get()
+		if connection is None:
+			connection = _open(self.host, port)
+		self.__ports[connection[0]] = (port, connection)
+		return connection[0]
+
+	def release(self, sim):
+		"""Give a sim object back to the pool
+		Args:
+			sim (RemoteAPIServer): The sim object
+		"""
+		if sim not in self.__ports:
+			raise Exception('The sim object does not belong to the pool')
+		self.__available.put(self.__ports.pop(sim))
+
+	@contextlib.contextmanager
+	def sim(self):
+		"""Take a sim object from the pool for the duration of a with block
+		Returns:
+			RemoteAPIServer: The sim object
+		"""
+		sim = self.acquire()
+		try:
+			yield sim
+		finally:
+			self.release(sim)
+
+	@contextlib.contextmanager
+	def exclusive(self):
+		"""Take every CoppeliaSim instance of the pool for the duration of a with block, so other processes can open their own connections.
+		The open connections of the pool stop stepping meanwhile, so they do not hold the simulations back
+		Returns:
+			list: The ports of the CoppeliaSim servers
+		"""
+		taken = []
+		while len(taken) < self.size:
+			try:
+				taken.append(self.__available.get_nowait())
+			except queue.Empty:
+				for entry in taken:
+					self.__available.put(entry)
+				raise Exception('Every sim object must be released to the pool before taking it exclusively')
+		try:
+			for _, connection in taken:
+				if connection is not None:
+					connection[0].setStepping(False)
+			yield [port for port, _ in taken]
+		finally:
+			for port, connection in taken:
+				if connection is not None:
+					connection[0].setStepping(True)
+				self.__available.put((port, connection))
+
+def _farmRun(sim, build, collect, param):
+	"""Build and play a timeline, then collect its result
+	Args:
+		sim (RemoteAPIServer): The sim object
+		build (function): The function that creates the timeline, as build(sim, param)
+		collect (function): The function that returns the result, as collect(sim, param), or None
+		param (any): The parameter of the run
+	Returns:
+		any: The result of the run
+	"""
+	build(sim, param).play()
+	return collect(sim, param) if collect is not None else None
+
+def _farmInit(ports, host: str):
+	"""Connect a farm worker process to its own CoppeliaSim instance
+	Args:
+		ports (multiprocessing.Queue): The ports not yet taken by a worker
+		host (str): The host of the CoppeliaSim servers
+	"""
+	connect(host, ports.get())
+
+def _farmProcess(build, collect, param):
+	"""Run a farm job in a worker process
+	Args:
+		build (function): The function that creates the timeline, as build(sim, param)
+		collect (function): The function that returns the result, as collect(sim, param), or None
+		param (any): The parameter of the run
+	Returns:
+		any: The result of the run
+	"""
+	return _farmRun(coppelia_sim, build, collect, param)
+
+def _farmThread(pool: Pool, build, collect, param):
+	"""Run a farm job in a worker thread
+	Args:
+		pool (Pool): The connection pool
+		build (function): The function that creates the timeline, as build(sim, param)
+		collect (function): The function that returns the result, as collect(sim, param), or None
+		param (any): The parameter of the run
+	Returns:
+		any: The result of the run
+	"""
+	with pool.sim() as sim:
+		return _farmRun(sim, build, collect, param)
+
+def farm(pool: Pool, build, params: list, collect = None, processes: bool = False) -> list:
+	"""Play a timeline for every parameter in parallel across the CoppeliaSim instances of a pool
+	Args:
+		pool (Pool): The connection pool
+		build (function): The function that creates the timeline, as build(sim, param)
+		params (list): The parameters, one run for each of them
+		collect (function): The function that returns the result of a run, as collect(sim, param)
+		processes (bool): If the runs should use worker processes instead of threads (build and collect must be picklable).
+			The workers open their own connections, so every sim object of the pool must be released first
+	Returns:
+		list: The result of every run, in the order of the parameters
+	"""
+	if processes:
+		context = multiprocessing.get_context()
+		ports = context.Queue()
+		with pool.exclusive() as available:
+			for port in available:
+				ports.put(port)
+			with ProcessPoolExecutor(pool.size, context, _farmInit, (ports, pool.host)) as executor:
+				return list(executor.map(_farmProcess, [build] * len(params), [collect] * len(params), params))
+	with ThreadPoolExecutor(pool.size) as executor:
+		return list(executor.map(lambda param: _farmThread(pool, build, collect, param), params))
+
+def _fastForward(sim, steps: int, condition: str, wall_timeout: float = None) -> int:
+	"""Let the simulation run freely until a number of steps or a condition is reached, paused by the helper
+	Args:
+		sim (RemoteAPIServer): The sim object
+		steps (int): The maximum number of steps
+		condition (str): The Lua condition, or an empty string
+		wall_timeout (float): The maximum real time to wait for, in seconds, or None to wait without limit
+	Returns:
+		int: 1 if the steps were reached, 2 if the condition was met, 0 if the simulation was stopped or paused by someone else
+	"""
+	state = sim.getSimulationState()
+	if state == sim.simulation_stopped or state == sim.simulation_paused:
+		raise Exception('Fast-forward needs a running simulation')
+	script = _installHelper(sim)
+	error = sim.callScriptFunction('coppeliaWait', script, steps, condition)
+	if error:
+		raise Exception(f'Invalid condition "{condition}": {error}')
+	sim.setStepping(False)
+	deadline = None if wall_timeout is None else time.monotonic() + wall_timeout
+	while True:
+		state, result = sim.callScriptFunction('coppeliaWaitState', script)
+		if result != 0 and state == sim.simulation_paused:
+			break
+		if state == sim.simulation_stopped or (result == 0 and state == sim.simulation_paused):
+			sim.callScriptFunction('coppeliaWaitCancel', script)
+			sim.setStepping(True)
+			return 0
+		if deadline is not None and time.monotonic() > deadline:
+			sim.callScriptFunction('coppeliaWaitCancel', script)
+			sim.setStepping(True)
+			raise Exception(f'Fast-forward did not finish within {wall_timeout} seconds')
+		time.sleep(0.005)
+	sim.setStepping(True)
+	sim.startSimulation()
+	return result
+
+def wait(duration: float, steps_per_second: int = 240, fast: bool = False, wall_timeout: float = 60.0):
 	"""Wait for a specified duration
 	Args:
 		duration (float): The duration to wait for
 		steps_per_second (int): The number of simulation steps per second
+		fast (bool): If the simulation should run the steps on its own instead of one remote call per step
+		wall_timeout (float): The maximum real time of a fast wait, in seconds, or None to wait without limit
 	"""
 	global coppelia_sim
 	if coppelia_sim is None:
 		raise Exception("Not connected to CoppeliaSim, call \"coppelia_connect()\" first.")
 	steps = math.ceil(duration * steps_per_second)
+	if fast and steps > 0 and coppelia_sim.getSimulationState() != coppelia_sim.simulation_stopped:
+		_fastForward(coppelia_sim, steps, '', wall_timeout)
+		return
 	for _ in range(steps):
 		coppelia_sim.step()
+
+def waitUntil(condition: str, timeout: float, steps_per_second: int = 240, wall_timeout: float = 60.0) -> bool:
+	"""Run the simulation until a condition is met, evaluating it on the server after every step
+	Args:
+		condition (str): The Lua expression to evaluate, like 'sim.getInt32Signal("done") == 1'
+		timeout (float): The maximum duration to wait for
+		steps_per_second (int): The number of simulation steps per second
+		wall_timeout (float): The maximum real time to wait for, in seconds, or None to wait without limit
+	Returns:
+		bool: True if the condition was met, False if the timeout was reached or the simulation was stopped or paused
+	"""
+	global coppelia_sim
+	if coppelia_sim is None:
+		raise Exception("Not connected to CoppeliaSim, call \"coppelia_connect()\" first.")
+	if type(condition) != str or condition == '':
+		raise Exception('"condition" must be a non-empty string')
+	if coppelia_sim.getSimulationState() == coppelia_sim.simulation_stopped:
+		raise Exception('"waitUntil" needs a running simulation')
+	steps = math.ceil(timeout * steps_per_second)
+	if steps <= 0:
+		return False
+	return _fastForward(coppelia_sim, steps, condition, wall_timeout) == 2
   
 def deg2rad(deg):
 	"""Convert degrees to radians
@@ -0,0 +1,211 @@
+# Copyright (c) 2024 Xavi Burgos
+#
+# Licensed under the MIT License. See LICENSE file in the project root for full
+# license information. Permission is granted to use, copy, modify, and distribute
+# this software for any purpose with or without fee, subject to the above
+# copyright notice and this permission notice.
+
+import json
+import time
+import collections
+
+SECTIONS = ('interpolation', 'callbacks', 'setters', 'reads', 'sim')
+
+class Profiler:
+
+	def __init__(self, sink = None):
+		"""Create a profiler that measures every step of a timeline
+		Args:
+			sink (function): The function that receives the record of every step, like a JsonlSink or a RingBuffer
+		"""
+		if sink is not None and not callable(sink):
+			raise Exception('"sink" must be a function')
+		self.sink = sink
+		self.steps = 0
+		self.totals = dict.fromkeys(SECTIONS, 0.0)
+		self.calls = collections.Counter()
+		self.histograms = {}
+		self.__record = None
+		self.__start = 0
+		self.__proxies = {}
+
+	def begin(self, step: int):
+		"""Start measuring a step
+		Args:
+			step (int): The step index
+		"""
+		self.__record = dict.fromkeys(SECTIONS, 0.0)
+		self.__record['step'] = step
+		self.__record['calls'] = 0
+		self.__start = time.perf_counter()
+
+	def end(self):
+		"""Finish measuring the current step and send its record to the sink"""
+		record = self.__record
+		record['total'] = time.perf_counter() - self.__start
+		record['interpolation'] = max(0.0, record['total'] - record['callbacks'] - record['setters'] - record['reads'] - record['sim'])
+		for section in SECTIONS:
+			self.totals[section] += record[section]
+		self.steps += 1
+		self.__record = None
+		if self.sink is not None:
+			self.sink(record)
+
+	def add(self, section: str, elapsed: float):
+		"""Add the time spent in a section to the current step
+		Args:
+			section (str): The section name
+			elapsed (float): The elapsed time in seconds
+		"""
+		if self.__record is None:
+			self.totals[section] += elapsed
+		else:
+			self.__record[section] += elapsed
+
+	def call(self, name: str, elapsed: float):
+		"""Count a remote call and add its latency to the histogram, in power of two microsecond buckets
+		Args:
+			name (str): The remote function name
+			elapsed (float): The latency in seconds
+		"""
+		self.calls[name] += 1
+		histogram = self.histograms.setdefault(name, [])
+		bucket = int(elapsed * 1e6).bit_length()
+		if bucket >= len(histogram):
+			histogram.extend([0] * (bucket + 1 - len(histogram)))
+		histogram[bucket] += 1
+		if self.__record is not None:
+			self.__record['calls'] += 1
+
+	def timed(self, function):
+		"""Wrap a callback so its execution time is added to the callbacks section
+		Args:
+			function (function): The callback
+		Returns:
+			function: The measured callback
+		"""
+		def wrapper(*args):
+			start = time.perf_counter()
+			try:
+				return function(*args)
+			finally:
+				self.add('callbacks', time.perf_counter() - start)
+		return wrapper
+
+	def wrap(self, sim) -> 'ProfiledSim':
+		"""Wrap a sim object so every remote call is counted and measured
+		Args:
+			sim (RemoteAPIServer): The sim object
+		Returns:
+			ProfiledSim: The measured sim object
+		"""
+		if sim not in self.__proxies:
+			self.__proxies[sim] = ProfiledSim(self, sim)
+		return self.__proxies[sim]
+
+	def summary(self) -> dict:
+		"""Get the totals of all the measured steps
+		Returns:
+			dict: The number of steps, the time per section, the remote calls and their latency histograms
+		"""
+		calls = sum(self.calls.values())
+		return {
+			'steps': self.steps,
+			'totals': dict(self.totals),
+			'calls': dict(self.calls),
+			'calls_per_step': calls / self.steps if self.steps > 0 else 0,
+			'histograms': {name: list(histogram) for name, histogram in self.histograms.items()}
+		}
+
+def _helperSection(args: tuple) -> str:
+	"""Get the section of a call to a helper function of the coppelia module. The calls of coppeliaApply that carry reads,
+	like the initial states read through a Batch, are reads, and the ones that only write are setters
+	Args:
+		args (tuple): The arguments of callScriptFunction, starting with the helper function name and the script handle
+	Returns:
+		str: The section name
+	"""
+	if args[0] == 'coppeliaApply':
+		return 'reads' if len(args) > 5 else 'setters'
+	if args[0].startswith('coppeliaGet') or args[0] == 'coppeliaWaitState':
+		return 'reads'
+	return 'setters'
+
+class ProfiledSim:
+
+	def __init__(self, profiler: Profiler, sim):
+		"""Create a proxy of a sim object that measures every remote call
+		Args:
+			profiler (Profiler): The profiler
+			sim (RemoteAPIServer): The sim object
+		"""
+		self.profiler = profiler
+		self.sim = sim
+
+	def __getattr__(self, name: str):
+		"""Get a constant or a measured function of the sim object
+		Args:
+			name (str): The attribute name
+		Returns:
+			any: The constant, or the measured function
+		"""
+		attr = getattr(self.sim, name)
+		if not callable(attr):
+			return attr
+		if name == 'step':
+			section = 'sim'
+		elif name.startswith('get'):
+			section = 'reads'
+		else:
+			section = 'setters'
+		profiler = self.profiler
+		def function(*args):
+			start = time.perf_counter()
+			try:
+				return attr(*args)
+			finally:
+				elapsed = time.perf_counter() - start
+				if name == 'callScriptFunction':
+					profiler.add(_helperSection(args), elapsed)
+					profiler.call(args[0], elapsed)
+				else:
+					profiler.add(section, elapsed)
+					profiler.call(name, elapsed)
+		setattr(self, name, function)
+		return function
+
+class JsonlSink:
+
+	def __init__(self, path: str):
+		"""Create a sink that appends every record to a JSON lines file
+		Args:
+			path (str): The path of the file
+		"""
+		self.file = open(path, 'a')
+
+	def __call__(self, record: dict):
+		"""Write a record
+		Args:
+			record (dict): The step record
+		"""
+		self.file.write(json.dumps(record) + '\n')
+
+	def close(self):
+		"""Close the file"""
+		self.file.close()
+
+class RingBuffer:
+
+	def __init__(self, size: int = 1000):
+		"""Create a sink that keeps the last records in memory
+		Args:
+			size (int): The maximum number of records
+		"""
+		self.records = collections.deque(maxlen=size)
+
+	def __call__(self, record: dict):
+		"""Store a record
+		Args:
+			record (dict): The step record
+		"""
+		self.records.append(record)
@@ -6,8 +6,237 @@
 # copyright notice and this permission notice.
 
 import math
+import queue
+import bisect
+import threading
+import itertools
+import asyncio
+import functools
+import collections
+import multiprocessing
+import numpy as np
+import coppelia
+import profiler
+import trajectory
 from coppeliasim_zmqremoteapi_client import RemoteAPIClient
 
+CHANNEL_POSITION = 1
+CHANNEL_ROTATION = 2
+CHANNEL_ANGLE = 4
+CHANNEL_QUATERNION = 8
+
+class Event:
+
+	__slots__ = ('target', 'name', 'start', 'end', 'duration', 'channels', 'paths', 'position', 'rotation', 'angle', 'quaternion', 'times', 'spline', 'ease', 'onStart', 'onUpdate', 'onEnd')
+
+	def __init__(self, target: int, name: str, vars: dict, start: float, end: float, duration: float):
+		"""Create a compact event, resolving its channels once
+		Args:
+			target (int): The target object
+			name (str): The target name
+			vars (dict): The complete target variables
+			start (float): The start of the event
+			end (float): The end of the event
+			duration (float): The duration of the event
+		"""
+		self.target = target
+		self.name = name
+		self.start = start
+		self.end = end
+		self.duration = duration
+		self.position = vars.get('position')
+		self.rotation = vars.get('rotation')
+		self.angle = vars.get('angle')
+		self.quaternion = vars.get('quaternion')
+		self.times = vars.get('times')
+		self.spline = vars.get('spline')
+		self.ease = vars['ease']
+		self.onStart = vars.get('onStart')
+		self.onUpdate = vars.get('onUpdate')
+		self.onEnd = vars.get('onEnd')
+		self.channels = (CHANNEL_POSITION if self.position is not None else 0) | (CHANNEL_ROTATION if self.rotation is not None else 0) | (CHANNEL_ANGLE if self.angle is not None else 0) | (CHANNEL_QUATERNION if self.quaternion is not None else 0)
+		self.paths = (CHANNEL_POSITION if self.position is not None and type(self.position[0]) == list else 0) | (CHANNEL_ROTATION if self.rotation is not None and type(self.rotation[0]) == list else 0) | (CHANNEL_ANGLE if type(self.angle) == list else 0)
+
+CompiledEvent = collections.namedtuple('CompiledEvent', ['target', 'name', 'start', 'end', 'duration', 'position', 'rotation', 'angle', 'onStart', 'onUpdate', 'onEnd', 'paths', 'spline', 'quaternion'])
+SPLINES = ('catmull-rom', 'cubic')
+
+class CubicBezier:
+
+	def __init__(self, p1x: float, p1y: float, p2x: float, p2y: float, samples: int = 0):
+		"""Create a cubic bezier ease function
+		Args:
+			p1x (float): The first control point x
+			p1y (float): The first control point y
+			p2x (float): The second control point x
+			p2y (float): The second control point y
+			samples (int): The size of the lookup table, or 0 to solve the curve on every call
+		"""
+		if type(samples) != int or samples < 0 or samples == 1:
+			raise Exception('"samples" must be 0 or an integer greater than 1')
+		self.__cx = 3.0 * p1x
+		self.__bx = 3.0 * (p2x - p1x) - self.__cx
+		self.__ax = 1.0 - self.__cx - self.__bx
+		self.__cy = 3.0 * p1y
+		self.__by = 3.0 * (p2y - p1y) - self.__cy
+		self.__ay = 1.0 - self.__cy - self.__by
+		self.__table = None
+		if samples > 0:
+			self.__table = self.__solve(np.linspace(0.0, 1.0, samples)).tolist()
+			self.__last = samples - 1
+
+	def __solve(self, x: np.ndarray) -> np.ndarray:
+		"""Solve the curve for an array of times
+		Args:
+			x (np.ndarray): The times (0 to 1)
+		Returns:
+			np.ndarray: The eased times
+		"""
+		ax, bx, cx = self.__ax, self.__bx, self.__cx
+		x = np.asarray(x, dtype=float)
+		t = x.copy()
+		for _ in range(8):
+			x2 = ((ax * t + bx) * t + cx) * t - x
+			d2 = (3.0 * ax * t + 2.0 * bx) * t + cx
+			pending = (np.abs(x2) >= 1e-7) & (np.abs(d2) >= 1e-6)
+			if not pending.any():
+				break
+			t = np.where(pending, t - x2 / np.where(pending, d2, 1.0), t)
+		x2 = ((ax * t + bx) * t + cx) * t - x
+		failed = np.abs(x2) >= 1e-7
+		if failed.any():
+			low = np.zeros(int(failed.sum()))
+			high = np.ones(len(low))
+			target = np.clip(x[failed], 0.0, 1.0)
+			for _ in range(40):
+				middle = (low + high) * 0.5
+				below = ((ax * middle + bx) * middle + cx) * middle < target
+				low = np.where(below, middle, low)
+				high = np.where(below, high, middle)
+			t[failed] = (low + high) * 0.5
+		return ((self.__ay * t + self.__by) * t + self.__cy) * t
+
+	def __call__(self, t: float) -> float:
+		"""Evaluate the ease function
+		Args:
+			t (float): The time (0 to 1)
+		Returns:
+			float: The eased time
+		"""
+		table = self.__table
+		if table is not None:
+			if t <= 0:
+				return table[0]
+			x = t * self.__last
+			i = int(x)
+			if i >= self.__last:
+				return table[-1]
+			y = table[i]
+			return y + (table[i + 1] - y) * (x - i)
+		ax, bx, cx = self.__ax, self.__bx, self.__cx
+		x = t
+		for _ in range(8):
+			x2 = ((ax * t + bx) * t + cx) * t - x
+			if abs(x2) < 1e-7:
+				return ((self.__ay * t + self.__by) * t + self.__cy) * t
+			d2 = (3.0 * ax * t + 2.0 * bx) * t + cx
+			if abs(d2) < 1e-6:
+				break
+			t = t - x2 / d2
+		low = 0.0
+		high = 1.0
+		x = min(max(x, 0.0), 1.0)
+		t = x
+		for _ in range(40):
+			x2 = ((ax * t + bx) * t + cx) * t
+			if abs(x2 - x) < 1e-7:
+				break
+			if x2 < x:
+				low = t
+			else:
+				high = t
+			t = (low + high) * 0.5
+		return ((self.__ay * t + self.__by) * t + self.__cy) * t
+
+	def array(self, t: np.ndarray) -> np.ndarray:
+		"""Evaluate the ease function over an array of times
+		Args:
+			t (np.ndarray): The times (0 to 1)
+		Returns:
+			np.ndarray: The eased times
+		"""
+		if self.__table is not None:
+			return np.interp(t, np.linspace(0.0, 1.0, self.__last + 1), self.__table)
+		return self.__solve(t)
+
+class Dispatcher:
+
+	def __init__(self, size: int = 1024, policy: str = 'block'):
+		"""Create a dispatcher that runs callbacks in a worker thread, in the same order they were called
+		Args:
+			size (int): The maximum number of callbacks waiting to run
+			policy (str): What to do when the queue is full, 'block' until there is room or 'drop' the callback
+		"""
+		self.policy = policy
+		self.dropped = 0
+		self.__queue = queue.Queue(size)
+		self.__thread = None
+		self.__error = None
+
+	def defer(self, function, droppable: bool = False):
+		"""Wrap a callback so calling it sends it to the worker thread instead of running it
+		Args:
+			function (function): The callback
+			droppable (bool): If the callback can be dropped by the 'drop' policy, only for per-step callbacks
+		Returns:
+			function: The deferred callback
+		"""
+		def deferred(*args):
+			self.put(function, args, droppable)
+		return deferred
+
+	def put(self, function, args: tuple, droppable: bool = False):
+		"""Send a callback to the worker thread, starting it if needed. Callbacks that are not droppable always wait for room
+		Args:
+			function (function): The callback
+			args (tuple): The arguments of the callback
+			droppable (bool): If the callback can be dropped by the 'drop' policy
+		"""
+		if self.__thread is None:
+			self.__thread = threading.Thread(target=self.__work, daemon=True)
+			self.__thread.start()
+		if self.policy == 'block' or not droppable:
+			self.__queue.put((function, args))
+			return
+		try:
+			self.__queue.put_nowait((function, args))
+		except queue.Full:
+			self.dropped += 1
+
+	def __work(self):
+		"""Run the callbacks until the end mark, keeping the first error"""
+		while True:
+			item = self.__queue.get()
+			if item is None:
+				break
+			function, args = item
+			try:
+				function(*args)
+			except Exception as error:
+				if self.__error is None:
+					self.__error = error
+
+	def join(self):
+		"""Wait until all the sent callbacks have run and stop the worker thread, raising the first error of a callback"""
+		if self.__thread is None:
+			return
+		self.__queue.put(None)
+		self.__thread.join()
+		self.__thread = None
+		error = self.__error
+		self.__error = None
+		if error is not None:
+			raise error
+
 class Timeline:
   
 	def __init__(self, sim: RemoteAPIClient, options: dict = {}):
@@ -30,16 +259,58 @@ class Timeline:
 			self.__options['yoyo'] = False
 		elif type(self.__options['yoyo']) != bool:
 			raise Exception('"yoyo" option must be a boolean')
+		if 'batch' not in self.__options:
+			self.__options['batch'] = False
+		elif type(self.__options['batch']) != bool:
+			raise Exception('"batch" option must be a boolean')
+		if 'loop' not in self.__options:
+			self.__options['loop'] = 1
+		elif type(self.__options['loop']) != int:
+			raise Exception('"loop" option must be an integer')
+		elif self.__options['loop'] < 0:
+			raise Exception('"loop" option cannot be negative')
+		if 'tolerance' not in self.__options:
+			self.__options['tolerance'] = {}
+		elif type(self.__options['tolerance']) != dict:
+			raise Exception('"tolerance" option must be a dictionary')
+		else:
+			for key, value in self.__options['tolerance'].items():
+				if key not in ('position', 'rotation', 'angle', 'quaternion'):
+					raise Exception(f'"tolerance" option cannot have "{key}", only "position", "rotation", "angle" or "quaternion"')
+				if type(value) != int and type(value) != float:
+					raise Exception(f'"tolerance" of "{key}" must be a number')
+				if value <= 0:
+					raise Exception(f'"tolerance" of "{key}" must be greater than 0')
+		if 'profiler' not in self.__options:
+			self.__options['profiler'] = None
+		elif self.__options['profiler'] is not None and not isinstance(self.__options['profiler'], profiler.Profiler):
+			raise Exception('"profiler" option must be a Profiler')
 		if 'steps_per_second' not in self.__options:
-			self.__options['steps_per_second'] = 240
+			self.__options['steps_per_second'] = self.__options.get('sim_rate', 240)
 		elif type(self.__options['steps_per_second']) != int:
 			raise Exception('"steps_per_second" option must be an integer')
+		if 'sim_rate' not in self.__options:
+			self.__options['sim_rate'] = self.__options['steps_per_second']
+		elif type(self.__options['sim_rate']) != int:
+			raise Exception('"sim_rate" option must be an integer')
+		elif self.__options['sim_rate'] != self.__options['steps_per_second']:
+			raise Exception('"sim_rate" and "steps_per_second" options cannot be different')
+		if self.__options['sim_rate'] <= 0:
+			raise Exception('"sim_rate" option must be greater than 0')
+		if 'control_rate' not in self.__options:
+			self.__options['control_rate'] = self.__options['sim_rate']
+		elif type(self.__options['control_rate']) != int:
+			raise Exception('"control_rate" option must be an integer')
+		elif self.__options['control_rate'] <= 0:
+			raise Exception('"control_rate" option must be greater than 0')
+		elif self.__options['sim_rate'] % self.__options['control_rate'] != 0:
+			raise Exception(f'"control_rate" must divide "sim_rate" ({self.__options["sim_rate"]})')
 		if 'debugs_per_second' not in self.__options:
 			self.__options['debugs_per_second'] = 2
 		elif type(self.__options['debugs_per_second']) != int:
 			raise Exception('"debugs_per_second" option must be an integer')
-		elif self.__options['debugs_per_second'] > self.__options['steps_per_second']:
-			raise Exception(f'"debugs_per_second" cannot be greater than "steps_per_second" (<= {self.__options["steps_per_second"]})')
+		elif self.__options['debugs_per_second'] > self.__options['control_rate']:
+			raise Exception(f'"debugs_per_second" cannot be greater than "control_rate" (<= {self.__options["control_rate"]})')
 		if 'onStart' in self.__options:
 			if not callable(self.__options['onStart']):
 				raise Exception('"onStart" option must be a function')
@@ -49,12 +320,34 @@ class Timeline:
 		if 'onComplete' in self.__options:
 			if not callable(self.__options['onComplete']):
 				raise Exception('"onComplete" option must be a function')
+		if 'onStep' in self.__options:
+			if not callable(self.__options['onStep']):
+				raise Exception('"onStep" option must be a function')
+		if 'callbacks' not in self.__options:
+			self.__options['callbacks'] = 'sync'
+		elif self.__options['callbacks'] not in ('sync', 'thread'):
+			raise Exception('"callbacks" option must be "sync" or "thread"')
+		if 'callback_queue' not in self.__options:
+			self.__options['callback_queue'] = 1024
+		elif type(self.__options['callback_queue']) != int:
+			raise Exception('"callback_queue" option must be an integer')
+		elif self.__options['callback_queue'] <= 0:
+			raise Exception('"callback_queue" option must be greater than 0')
+		if 'callback_policy' not in self.__options:
+			self.__options['callback_policy'] = 'block'
+		elif self.__options['callback_policy'] not in ('block', 'drop'):
+			raise Exception('"callback_policy" option must be "block" or "drop"')
 		self.__timeline = []
+		self.__intervals = {}
 		self.__duration = 0
 		self.__previousStart = 0
 		self.__previousEnd = 0
 		self.__previousDuration = 0
-		self.__posibleVars = ['position', 'rotation', 'angle', 'duration', 'ease', 'delay', 'onStart', 'onUpdate', 'onEnd']
+		self.__compiled = None
+		self.__stream = None
+		self.__queue = queue.SimpleQueue()
+		self.__dispatcher = Dispatcher(self.__options['callback_queue'], self.__options['callback_policy']) if self.__options['callbacks'] == 'thread' else None
+		self.__posibleVars = ['position', 'rotation', 'angle', 'quaternion', 'duration', 'ease', 'delay', 'times', 'spline', 'onStart', 'onUpdate', 'onEnd']
 
 	def __decodePosition(self, position) -> float:
 		"""Decode the position
@@ -163,20 +456,55 @@ class Timeline:
 			raise Exception('No target variables found')
 		for key in vars:
 			value = vars[key]
-			if key == 'position':
+			if key == 'position' or key == 'rotation':
 				if type(value) != list:
-					raise Exception('"position" must be a list')
-				if len(value) != 3:
-					raise Exception('"position" must have 3 values')
-				for i in range(3):
-					if type(value[i]) != int and type(value[i]) != float:
-						raise Exception('"position" values must be numbers')
-			elif key == 'rotation':
-				if type(value) != int and type(value) != float:
-					raise Exception('"rotation" must be a number')
+					raise Exception(f'"{key}" must be a list')
+				if len(value) > 0 and type(value[0]) == list:
+					waypoints = value
+				else:
+					waypoints = [value]
+				for waypoint in waypoints:
+					if type(waypoint) != list:
+						raise Exception(f'"{key}" waypoints must be lists')
+					if len(waypoint) != 3:
+						raise Exception(f'"{key}" must have 3 values')
+					for i in range(3):
+						if type(waypoint[i]) != int and type(waypoint[i]) != float:
+							raise Exception(f'"{key}" values must be numbers')
 			elif key == 'angle':
-				if type(value) != int and type(value) != float:
-					raise Exception('"angle" must be a number')
+				if type(value) == list:
+					if len(value) == 0:
+						raise Exception('"angle" waypoints cannot be empty')
+					for waypoint in value:
+						if type(waypoint) != int and type(waypoint) != float:
+							raise Exception('"angle" waypoints must be numbers')
+				elif type(value) != int and type(value) != float:
+					raise Exception('"angle" must be a number or a list of numbers')
+			elif key == 'quaternion':
+				if type(value) != list or len(value) != 4:
+					raise Exception('"quaternion" must be a list of 4 values [x, y, z, w]')
+				for i in range(4):
+					if type(value[i]) != int and type(value[i]) != float:
+						raise Exception('"quaternion" values must be numbers')
+				if value[0] == 0 and value[1] == 0 and value[2] == 0 and value[3] == 0:
+					raise Exception('"quaternion" cannot be zero')
+				if 'rotation' in vars:
+					raise Exception('"rotation" and "quaternion" cannot be used in the same movement')
+			elif key == 'times':
+				if type(value) != list or len(value) == 0:
+					raise Exception('"times" must be a list of numbers')
+				previous = 0
+				for time in value:
+					if type(time) != int and type(time) != float:
+						raise Exception('"times" must be a list of numbers')
+					if time <= previous:
+						raise Exception('"times" must be increasing and greater than 0')
+					previous = time
+				if value[-1] != 1:
+					raise Exception('"times" must end at 1')
+			elif key == 'spline':
+				if value not in SPLINES:
+					raise Exception(f'"spline" must be one of {", ".join(SPLINES)}')
 			elif key == 'duration':
 				if type(value) != int and type(value) != float:
 					raise Exception('"duration" must be a number')
@@ -195,6 +523,13 @@ class Timeline:
 					raise Exception(f'"{key}" must be a function')
 			elif self.__options['debug']:
 				print(f'Warning: "{key}" is not a valid variable')
+		if 'times' in vars:
+			for key in ('position', 'rotation', 'angle'):
+				if key not in vars:
+					continue
+				value = vars[key]
+				if type(value) == list and len(value) > 0 and (key == 'angle' or type(value[0]) == list) and len(value) != len(vars['times']):
+					raise Exception(f'"times" must have a time for every "{key}" waypoint')
   
 	def __completeVars(self, vars: dict) -> dict:
 		"""Complete the variables
@@ -209,43 +544,110 @@ class Timeline:
 			vars['ease'] = self.easeInOut
 		if 'delay' not in vars:
 			vars['delay'] = 0
+		if 'spline' not in vars:
+			vars['spline'] = 'catmull-rom'
 		return vars
 
-	def to(self, target: dict, vars: dict, position = None) -> 'Timeline':
-		"""Add a target animation to the timeline
+	def __event(self, target: dict, name: str, vars: dict, position) -> Event:
+		"""Create an event and move the timeline cursor to it
 		Args:
 			target (dict): The target object
+			name (str): The target name
 			vars (dict): The target variables
 			position (float): The position in the timeline
 		Returns:
-			Timeline: The timeline object
+			Event: The event
 		"""
-		name = self._sim.getObjectName(target)
 		vars = self.__mergeVars(vars)
 		self.__checkVars(vars)
 		vars = self.__completeVars(vars)
 		delay = vars['delay']
 		start = self.__decodePosition(position) + delay
+		if self.__stream is not None:
+			start = max(start, self.__stream['step'] / self.__options['control_rate'])
 		duration = vars['duration']
 		end = start + duration
-		for t in self.__timeline:
-			if target != t['target']:
-				continue
-			if end > t['start'] and start < t['end']:
-				raise Exception('Target animation overlaps with another previous animation')
-		self.__timeline.append({
-			'target': target,
-			'name': name,
-			'vars': vars,
-			'start': start,
-			'end': end,
-			'duration': duration
-		})
 		self.__previousStart = start
 		self.__previousEnd = end
 		self.__previousDuration = vars['duration']
 		if end > self.__duration:
 			self.__duration = end
+		return Event(target, name, vars, start, end, duration)
+
+	def __overlaps(self, target: dict, start: float, end: float) -> bool:
+		"""Check if an interval overlaps with a previous animation of the same target
+		Args:
+			target (dict): The target object
+			start (float): The interval start
+			end (float): The interval end
+		Returns:
+			bool: True if the interval overlaps
+		"""
+		intervals = self.__intervals.get(target)
+		if intervals is None:
+			return False
+		i = bisect.bisect_left(intervals, (end,)) - 1
+		return i >= 0 and intervals[i][1] > start
+
+	def __insert(self, event: Event):
+		"""Insert an event into the timeline and its target index
+		Args:
+			event (Event): The event
+		"""
+		self.__timeline.append(event)
+		bisect.insort(self.__intervals.setdefault(event.target, []), (event.start, event.end))
+		self.__compiled = None
+
+	def to(self, target: dict, vars: dict, position = None) -> 'Timeline':
+		"""Add a target animation to the timeline
+		Args:
+			target (dict): The target object
+			vars (dict): The target variables
+			position (float): The position in the timeline
+		Returns:
+			Timeline: The timeline object
+		"""
+		name = coppelia.getObjectName(target, self._sim) if self._sim is not None else str(target)
+		cursor = (self.__previousStart, self.__previousEnd, self.__previousDuration, self.__duration)
+		event = self.__event(target, name, vars, position)
+		if self.__overlaps(target, event.start, event.end):
+			self.__previousStart, self.__previousEnd, self.__previousDuration, self.__duration = cursor
+			raise Exception('Target animation overlaps with another previous animation')
+		self.__insert(event)
+		return self
+
+	def add_many(self, tweens: list) -> 'Timeline':
+		"""Add several target animations to the timeline, validating all of them before inserting any
+		Args:
+			tweens (list): The animations, as (target, vars) or (target, vars, position) tuples
+		Returns:
+			Timeline: The timeline object
+		"""
+		if type(tweens) != list:
+			raise Exception('"tweens" must be a list')
+		for tween in tweens:
+			if type(tween) != tuple or len(tween) < 2 or len(tween) > 3:
+				raise Exception('Each tween must be a (target, vars) or (target, vars, position) tuple')
+		targets = [tween[0] for tween in tweens]
+		names = coppelia.getObjectNames(targets, self._sim) if self._sim is not None else [str(target) for target in targets]
+		cursor = (self.__previousStart, self.__previousEnd, self.__previousDuration, self.__duration)
+		try:
+			events = [self.__event(tween[0], name, tween[1], tween[2] if len(tween) == 3 else None) for tween, name in zip(tweens, names)]
+			groups = {}
+			for event in events:
+				groups.setdefault(event.target, []).append((event.start, event.end))
+			for target, intervals in groups.items():
+				intervals.sort()
+				end = -math.inf
+				for interval in intervals:
+					if interval[0] < end or self.__overlaps(target, interval[0], interval[1]):
+						raise Exception('Target animation overlaps with another previous animation')
+					end = max(end, interval[1])
+		except Exception:
+			self.__previousStart, self.__previousEnd, self.__previousDuration, self.__duration = cursor
+			raise
+		for event in events:
+			self.__insert(event)
 		return self
 
 	@staticmethod
@@ -294,30 +696,22 @@ class Timeline:
 		Returns:
 			float: The eased time
 		"""
-		cx = 3.0 * p1x
-		bx = 3.0 * (p2x - p1x) - cx
-		ax = 1.0 - cx - bx
-		cy = 3.0 * p1y
-		by = 3.0 * (p2y - p1y) - cy
-		ay = 1.0 - cy - by
-		def sampleCurveX(t):
-			return ((ax * t + bx) * t + cx) * t
-		def sampleCurveY(t):
-			return ((ay * t + by) * t + cy) * t
-		def sampleCurveDerivativeX(t):
-			return (3.0 * ax * t + 2.0 * bx) * t + cx
-		def solveCurveX(x):
-			t2 = x
-			for _ in range(8):
-				x2 = sampleCurveX(t2) - x
-				if abs(x2) < 1e-3:
-					return t2
-				d2 = sampleCurveDerivativeX(t2)
-				if abs(d2) < 1e-3:
-					break
-				t2 = t2 - x2 / d2
-			return t2
-		return sampleCurveY(solveCurveX(t))
+		return Timeline.bezier(p1x, p1y, p2x, p2y)(t)
+
+	@staticmethod
+	@functools.lru_cache(maxsize=128)
+	def bezier(p1x: float, p1y: float, p2x: float, p2y: float, samples: int = 0) -> CubicBezier:
+		"""Create a reusable cubicBezier ease function, cached by its control points
+		Args:
+			p1x (float): The first control point x
+			p1y (float): The first control point y
+			p2x (float): The second control point x
+			p2y (float): The second control point y
+			samples (int): The size of the lookup table, or 0 to solve the curve on every call
+		Returns:
+			CubicBezier: The ease function
+		"""
+		return CubicBezier(p1x, p1y, p2x, p2y, samples)
 
 	@staticmethod
 	def linear(t: float) -> float:
@@ -329,25 +723,195 @@ class Timeline:
 		"""
 		return t
 
-	def __yoyo(self, timeline: list, duration: float) -> tuple:
-		"""Yoyo the timeline
+	@staticmethod
+	def easeInOutArray(t: np.ndarray) -> np.ndarray:
+		"""The vectorized ease-in-out function
+		Args:
+			t (np.ndarray): The times (0 to 1)
+		Returns:
+			np.ndarray: The eased times
+		"""
+		u = 2 * t - 2
+		return np.where(t < 0.5, 4 * t * t * t, 0.5 * u * u * u + 1)
+
+	@staticmethod
+	def easeOutArray(t: np.ndarray) -> np.ndarray:
+		"""The vectorized ease-out function
+		Args:
+			t (np.ndarray): The times (0 to 1)
+		Returns:
+			np.ndarray: The eased times
+		"""
+		t = t - 1
+		return t * t * t + 1
+
+	@staticmethod
+	def easeInArray(t: np.ndarray) -> np.ndarray:
+		"""The vectorized ease-in function
+		Args:
+			t (np.ndarray): The times (0 to 1)
+		Returns:
+			np.ndarray: The eased times
+		"""
+		return t * t * t
+
+	@staticmethod
+	def cubicBezierArray(t: np.ndarray, p1x: float, p1y: float, p2x: float, p2y: float) -> np.ndarray:
+		"""The vectorized cubicBezier function
 		Args:
-			timeline (list): The timeline
-			duration (float): The duration
+			t (np.ndarray): The times (0 to 1)
+			p1x (float): The first control point x
+			p1y (float): The first control point y
+			p2x (float): The second control point x
+			p2y (float): The second control point y
 		Returns:
-			tuple: The timeline and the duration
+			np.ndarray: The eased times
 		"""
-		duration *= 2
-		timeline_ = []
-		for t in timeline:
-			t = t.copy()
-			start = t['start']
-			t['start'] = duration - t['end']
-			t['end'] = duration - start
-			timeline_.append(t)
-		timeline_.reverse()
-		timeline.extend(timeline_)
-		return timeline, duration
+		return Timeline.bezier(p1x, p1y, p2x, p2y).array(t)
+
+	@staticmethod
+	def linearArray(t: np.ndarray) -> np.ndarray:
+		"""The vectorized linear function
+		Args:
+			t (np.ndarray): The times (0 to 1)
+		Returns:
+			np.ndarray: The eased times
+		"""
+		return t
+
+	def __arrayEase(self, ease) -> callable:
+		"""Get the vectorized counterpart of an ease function
+		Args:
+			ease (function): The ease function
+		Returns:
+			function: The ease function applied over an array of times
+		"""
+		if ease is self.easeInOut:
+			return self.easeInOutArray
+		if ease is self.easeOut:
+			return self.easeOutArray
+		if ease is self.easeIn:
+			return self.easeInArray
+		if ease is self.linear:
+			return self.linearArray
+		if isinstance(ease, CubicBezier):
+			return ease.array
+		return lambda t: np.fromiter(map(ease, t.tolist()), dtype=float, count=len(t))
+
+	@staticmethod
+	def __spline(initial: np.ndarray, knots: np.ndarray, waypoints: np.ndarray, spline: str, progress: np.ndarray) -> np.ndarray:
+		"""Evaluate a path from the initial value through its waypoints for all the steps of an event at once.
+		The cubic coefficients of every segment are computed once, then every step is evaluated by looking up its segment
+		Args:
+			initial (np.ndarray): The initial value
+			knots (np.ndarray): The time of the initial value and of every waypoint (0 to 1)
+			waypoints (np.ndarray): The waypoints
+			spline (str): The spline type, "catmull-rom" or "cubic" (natural cubic spline)
+			progress (np.ndarray): The eased progress of every step
+		Returns:
+			np.ndarray: The value of every step
+		"""
+		points = np.concatenate((initial.reshape(1, -1), waypoints.reshape(len(waypoints), -1)))
+		h = np.diff(knots)[:, np.newaxis]
+		slopes = np.diff(points, axis=0) / h
+		n = len(points)
+		if n == 2:
+			tangents = np.concatenate((slopes, slopes))
+		elif spline == 'catmull-rom':
+			tangents = np.concatenate((slopes[:1], (points[2:] - points[:-2]) / (knots[2:] - knots[:-2])[:, np.newaxis], slopes[-1:]))
+		else:
+			lower = np.concatenate((h[1:, 0], [1.0]))
+			diagonal = np.concatenate(([2.0], 2 * (h[:-1, 0] + h[1:, 0]), [2.0]))
+			upper = np.concatenate(([1.0], h[:-1, 0]))
+			rhs = np.concatenate((3 * slopes[:1], 3 * (h[1:] * slopes[:-1] + h[:-1] * slopes[1:]), 3 * slopes[-1:]))
+			for i in range(1, n):
+				w = lower[i - 1] / diagonal[i - 1]
+				diagonal[i] -= w * upper[i - 1]
+				rhs[i] -= w * rhs[i - 1]
+			tangents = np.empty_like(rhs)
+			tangents[-1] = rhs[-1] / diagonal[-1]
+			for i in range(n - 2, -1, -1):
+				tangents[i] = (rhs[i] - upper[i] * tangents[i + 1]) / diagonal[i]
+		a = 2 * points[:-1] - 2 * points[1:] + h * (tangents[:-1] + tangents[1:])
+		b = 3 * points[1:] - 3 * points[:-1] - h * (2 * tangents[:-1] + tangents[1:])
+		c = h * tangents[:-1]
+		d = points[:-1]
+		segment = np.clip(np.searchsorted(knots, progress, side='right') - 1, 0, n - 2)
+		u = ((progress - knots[segment]) / h[segment, 0])[:, np.newaxis]
+		values = ((a[segment] * u + b[segment]) * u + c[segment]) * u + d[segment]
+		values[progress == 1.0] = points[-1]
+		values[progress == 0.0] = points[0]
+		return values.reshape((len(progress),) + initial.shape)
+
+	@staticmethod
+	def __interpolate(initial, final, progress: np.ndarray, tolerance: float = None, path: tuple = None, spline: str = None, origin = None) -> list:
+		"""Interpolate between two values for all the steps of an event at once
+		Args:
+			initial (float | list): The initial value
+			final (float | list): The final value
+			progress (np.ndarray): The eased progress of every step
+			tolerance (float): The change below which a step is not written, or None to write every step
+			path (tuple): The knots and the waypoints of a path, or None to move straight to the final value
+			spline (str): The spline type of the path
+			origin (float | list): The value the movement starts from, if it is not the initial value (the final value of a reversed yoyo)
+		Returns:
+			list: The interpolated value of every step, or None for the steps that should not be written
+		"""
+		initial = np.asarray(initial, dtype=float)
+		if path is None:
+			final = np.asarray(final, dtype=float)
+			values = np.multiply.outer(progress, final) + np.multiply.outer(1 - progress, initial)
+		else:
+			values = Timeline.__spline(initial, path[0], path[1], spline, progress)
+		return Timeline.__rows(initial if origin is None else np.asarray(origin, dtype=float), values, tolerance)
+
+	@staticmethod
+	def __rows(initial: np.ndarray, values: np.ndarray, tolerance: float = None) -> list:
+		"""Convert the values of every step into the rows written by the run
+		Args:
+			initial (np.ndarray): The value the movement starts from, which the first step is compared to
+			values (np.ndarray): The value of every step
+			tolerance (float): The change below which a step is not written, or None to write every step
+		Returns:
+			list: The value of every step, or None for the steps that should not be written
+		"""
+		if tolerance is None:
+			return values.tolist()
+		levels = np.floor(np.concatenate((initial[np.newaxis], values)) / tolerance)
+		changed = np.diff(levels, axis=0) != 0
+		if changed.ndim > 1:
+			changed = changed.any(axis=1)
+		changed[-1] = True
+		return [value if write else None for value, write in zip(values.tolist(), changed.tolist())]
+
+	@staticmethod
+	def slerp(q0, q1, t) -> np.ndarray:
+		"""Interpolate between quaternions along the shortest arc, for one or many objects and all the steps at once.
+		The angle and its sine are computed once per object, so every step only needs two sines and a few products
+		Args:
+			q0 (list | np.ndarray): The initial quaternion [x, y, z, w], or an array of N quaternions
+			q1 (list | np.ndarray): The final quaternion [x, y, z, w], or an array of N quaternions
+			t (float | np.ndarray): The progress (0 to 1), or an array of S progresses
+		Returns:
+			np.ndarray: The interpolated quaternions, with shape (S, N, 4), (S, 4), (N, 4) or (4,)
+		"""
+		q0 = np.asarray(q0, dtype=float)
+		q1 = np.asarray(q1, dtype=float)
+		q0 = q0 / np.linalg.norm(q0, axis=-1, keepdims=True)
+		q1 = q1 / np.linalg.norm(q1, axis=-1, keepdims=True)
+		dot = np.sum(q0 * q1, axis=-1, keepdims=True)
+		q1 = np.where(dot < 0, -q1, q1)
+		dot = np.abs(dot)
+		theta = np.arccos(np.minimum(dot, 1.0))
+		sin = np.sin(theta)
+		small = sin < 1e-9
+		sin = np.where(small, 1.0, sin)
+		t = np.asarray(t, dtype=float)
+		t = t.reshape(t.shape + (1,) * q0.ndim)
+		w0 = np.where(small, 1 - t, np.sin((1 - t) * theta) / sin)
+		w1 = np.where(small, t, np.sin(t * theta) / sin)
+		q = w0 * q0 + w1 * q1
+		return q / np.linalg.norm(q, axis=-1, keepdims=True)
 
 	@staticmethod
 	def deg2rad(deg: float) -> float:
@@ -369,149 +933,615 @@ class Timeline:
 		"""
 		return rad * 180 / math.pi
 
-	def play(self) -> 'Timeline':
-		"""Play the timeline
+	def __compileEvent(self, t: Event, progresses: dict) -> tuple:
+		"""Compile an event, quantizing its times to integer steps and evaluating its ease over all its steps.
+		The progress only depends on the ease and the duration in steps, so it is shared by the events that have the same ones
+		Args:
+			t (Event): The event
+			progresses (dict): The progresses already evaluated, as {(ease, duration): progress}
+		Returns:
+			tuple: The compiled event and its read-only progress, or None if it has no channels
+		"""
+		sps = self.__options['control_rate']
+		profiler = self.__options['profiler']
+		callbacks = [t.onStart, t.onUpdate, t.onEnd]
+		if self.__dispatcher is not None:
+			callbacks = [None if callback is None else self.__dispatcher.defer(callback, c == 1) for c, callback in enumerate(callbacks)]
+		if profiler is not None:
+			callbacks = [None if callback is None else profiler.timed(callback) for callback in callbacks]
+		start = round(t.start * sps)
+		end = round(t.end * sps)
+		finals = [t.position, t.rotation, t.angle]
+		paths = None
+		if t.paths:
+			paths = {}
+			for c, kind in enumerate((CHANNEL_POSITION, CHANNEL_ROTATION, CHANNEL_ANGLE)):
+				if t.paths & kind:
+					waypoints = np.array(finals[c], dtype=float)
+					knots = np.concatenate(([0.0], t.times)) if t.times is not None else np.linspace(0.0, 1.0, len(waypoints) + 1)
+					paths[kind] = (knots, waypoints)
+					finals[c] = finals[c][-1]
+		event = CompiledEvent(t.target, t.name, start, end, end - start, *finals, *callbacks, paths, t.spline, t.quaternion)
+		progress = None
+		if t.channels:
+			key = (t.ease, event.duration)
+			progress = progresses.get(key)
+			if progress is None:
+				if event.duration > 0:
+					progress = self.__arrayEase(t.ease)(np.arange(1, event.duration + 1, dtype=float) / event.duration)
+					progress[-1] = 1.0
+				else:
+					progress = np.ones(1)
+				progress.flags.writeable = False
+				progresses[key] = progress
+		return event, progress
+
+	def compile(self) -> 'Timeline':
+		"""Compile the timeline into an immutable representation. The times are quantized to integer steps and the ease of every event
+		is evaluated over all its steps at once, ending exactly at 1, and shared by the events with the same ease and duration.
+		With yoyo, the reversed half reuses the progress of the original event backwards
 		Returns:
 			Timeline: The timeline object
 		"""
-		duration = self.__duration
-		timeline = self.__timeline.copy()
-		timeline.sort(key=lambda x: x['start'])
+		duration = round(self.__duration * self.__options['control_rate'])
+		timeline = sorted(self.__timeline, key=lambda x: x.start)
+		events = []
+		schedule = []
+		progresses = {}
+		for j, t in enumerate(timeline):
+			event, progress = self.__compileEvent(t, progresses)
+			events.append(event)
+			schedule.append((event.start, event.end, progress, j, False))
 		if self.__options['yoyo']:
-			timeline, duration = self.__yoyo(timeline, duration)
-		sps = self.__options['steps_per_second']
-		duration *= sps
-		for t in timeline:
-			t['start'] *= sps
-			t['end'] *= sps
-			t['duration'] *= sps
+			mirrored = {}
+			for j in reversed(range(len(timeline))):
+				start, end, progress = schedule[j][:3]
+				if progress is not None:
+					if id(progress) not in mirrored:
+						reverse = np.concatenate((progress[-2::-1], [0.0]))
+						reverse.flags.writeable = False
+						mirrored[id(progress)] = reverse
+					progress = mirrored[id(progress)]
+				schedule.append((duration * 2 - end, duration * 2 - start, progress, j, True))
+			duration *= 2
+		schedule.sort(key=lambda x: x[0])
+		starts = {}
+		for s in range(len(schedule)):
+			starts.setdefault(schedule[s][0], []).append(s)
+		self.__compiled = (tuple(events), tuple(schedule), {i: tuple(s) for i, s in starts.items()}, duration)
+		return self
+
+	def play(self) -> 'Timeline':
+		"""Play the timeline, as many times as the "loop" option says. The compiled timeline is reused by every loop and every call
+		Returns:
+			Timeline: The timeline object
+		"""
+		if self.__compiled is None:
+			self.compile()
+		sim = self._sim
+		if self.__options['profiler'] is not None:
+			sim = self.__options['profiler'].wrap(sim)
+		writer = coppelia.Batch(sim) if self.__options['batch'] else sim
+		loops = self.__options['loop']
+		loop = 0
+		while loops == 0 or loop < loops:
+			self.__drive(self.__run(writer, True, self.__compiled), writer)
+			loop += 1
+		return self
+
+	def play_sharded(self, shards: int, host: str = 'localhost', port: int = 23000) -> 'Timeline':
+		"""Play the timeline splitting its targets into groups, each one interpolated and written by a worker process with its own connection.
+		The workers keep in step with a barrier, and this process steps the simulation and runs the global callbacks. The callbacks of
+		the movements run in the worker of their target. The workers are forked, so the timeline does not need to be picklable
+		Args:
+			shards (int): The maximum number of worker processes
+			host (str): The host of the CoppeliaSim server of the timeline
+			port (int): The port of the CoppeliaSim server of the timeline
+		Returns:
+			Timeline: The timeline object
+		"""
+		if type(shards) != int or shards <= 0:
+			raise Exception('"shards" must be an integer greater than 0')
+		if 'fork' not in multiprocessing.get_all_start_methods():
+			raise Exception('"play_sharded" needs the "fork" start method of multiprocessing')
+		if 'onStep' in self.__options:
+			raise Exception('"onStep" option is not supported by "play_sharded"')
+		if self.__compiled is None:
+			self.compile()
+		groups = self.__partition(shards)
+		context = multiprocessing.get_context('fork')
+		barrier = context.Barrier(len(groups) + 1)
+		errors = context.SimpleQueue()
+		workers = [context.Process(target=self.__shard, args=(compiled, host, port, barrier, errors), daemon=True) for compiled in groups]
+		for worker in workers:
+			worker.start()
+		sim = self._sim
+		if self.__options['profiler'] is not None:
+			sim = self.__options['profiler'].wrap(sim)
+		writer = coppelia.Lockstep(sim, barrier, self.__options['sim_rate'] // self.__options['control_rate'], True)
+		events, _, _, duration = self.__compiled
+		loops = self.__options['loop']
+		loop = 0
+		broken = False
+		try:
+			while loops == 0 or loop < loops:
+				self.__drive(self.__run(writer, True, (events, (), {}, duration)), sim)
+				loop += 1
+		except threading.BrokenBarrierError:
+			broken = True
+		except BaseException:
+			barrier.abort()
+			raise
+		finally:
+			for worker in workers:
+				worker.join()
+		if broken:
+			raise Exception(errors.get() if not errors.empty() else 'A shard stopped before the end of the timeline')
+		return self
+
+	def __partition(self, shards: int) -> list:
+		"""Split the compiled timeline into groups of targets, balancing the number of steps each group interpolates
+		Args:
+			shards (int): The maximum number of groups
+		Returns:
+			list: The compiled timeline of every group, sharing the events of the whole timeline
+		"""
+		events, schedule, _, duration = self.__compiled
+		weights = collections.Counter()
+		for start, end, progress, j, reverse in schedule:
+			weights[events[j].target] += end - start + 1
+		loads = [0] * min(shards, len(weights))
+		groups = {}
+		for target, weight in sorted(weights.items(), key=lambda x: -x[1]):
+			g = loads.index(min(loads))
+			groups[target] = g
+			loads[g] += weight
+		compiled = []
+		for g in range(len(loads)):
+			subset = tuple(entry for entry in schedule if groups[events[entry[3]].target] == g)
+			starts = {}
+			for s in range(len(subset)):
+				starts.setdefault(subset[s][0], []).append(s)
+			compiled.append((events, subset, {i: tuple(s) for i, s in starts.items()}, duration))
+		return compiled
+
+	def __shard(self, compiled: tuple, host: str, port: int, barrier, errors):
+		"""Play a group of targets in a worker process, in step with the process that steps the simulation.
+		The worker runs on a forked copy of the timeline, leaving the global callbacks and the profiler to the main process
+		Args:
+			compiled (tuple): The compiled timeline of the group
+			host (str): The host of the CoppeliaSim server
+			port (int): The port of the CoppeliaSim server
+			barrier (multiprocessing.Barrier): The barrier shared with the other processes
+			errors (multiprocessing.SimpleQueue): The queue where the error of the worker is sent
+		"""
+		try:
+			self.__options = {key: value for key, value in self.__options.items() if key not in ('onStart', 'onUpdate', 'onComplete')}
+			self.__options['profiler'] = None
+			sim, _ = coppelia._open(host, port, False)
+			reader = coppelia.Batch(sim) if self.__options['batch'] else sim
+			writer = coppelia.Lockstep(reader, barrier, self.__options['sim_rate'] // self.__options['control_rate'])
+			loops = self.__options['loop']
+			loop = 0
+			while loops == 0 or loop < loops:
+				self.__drive(self.__run(writer, True, compiled), reader)
+				loop += 1
+		except threading.BrokenBarrierError:
+			pass
+		except BaseException as error:
+			errors.put(f'{type(error).__name__}: {error}')
+			barrier.abort()
+
+	async def play_async(self) -> 'Timeline':
+		"""Play the timeline on a sim object returned by coppelia.connect_async, pipelining the remote calls
+		Returns:
+			Timeline: The timeline object
+		"""
+		if not isinstance(self._sim, coppelia.AsyncSim):
+			raise Exception('"play_async" needs a sim object returned by "coppelia.connect_async()"')
+		if self.__options['profiler'] is not None:
+			raise Exception('"profiler" option is not supported by "play_async"')
+		if self.__compiled is None:
+			self.compile()
+		client = self._sim.client
+		writer = coppelia.Batch(self._sim) if self.__options['batch'] else self._sim
+		loops = self.__options['loop']
+		loop = 0
+		while loops == 0 or loop < loops:
+			run = self.__run(writer, True, self.__compiled)
+			try:
+				request = next(run)
+				while True:
+					if request is None:
+						await client.throttle()
+						request = run.send(None)
+					else:
+						states = coppelia.getStates(request, writer)
+						if type(states) == list:
+							states = await asyncio.gather(*states)
+						else:
+							states = await states
+						request = run.send(states)
+			except StopIteration:
+				pass
+			loop += 1
+		await client.drain()
+		return self
+
+	def enqueue(self, target: dict, vars: dict, position = None) -> 'Timeline':
+		"""Add a target animation to a streaming timeline from any thread or coroutine, without blocking.
+		The animation is added with to() at the beginning of the next step_once call, and starts no earlier than that step
+		Args:
+			target (dict): The target object
+			vars (dict): The target variables
+			position (float): The position in the timeline
+		Returns:
+			Timeline: The timeline object
+		"""
+		self.__queue.put((target, vars, position))
+		return self
+
+	def step_once(self) -> bool:
+		"""Play one step of the timeline in streaming mode, so an external loop can drive it. The first call starts the stream,
+		then every call adds the enqueued animations, plus the ones added with to() since the previous call, and plays the next step
+		Returns:
+			bool: True if there are animations running or waiting to start
+		"""
+		if self.__stream is None:
+			if self.__options['yoyo']:
+				raise Exception('"yoyo" option is not supported by streaming')
+			sim = self._sim
+			if self.__options['profiler'] is not None:
+				sim = self.__options['profiler'].wrap(sim)
+			writer = coppelia.Batch(sim) if self.__options['batch'] else sim
+			compiled = ({}, {}, {}, None)
+			self.__stream = {'writer': writer, 'compiled': compiled, 'run': self.__run(writer, True, compiled), 'step': 0, 'added': 0, 'next': 0, 'end': 0, 'progresses': {}}
+		stream = self.__stream
+		while True:
+			try:
+				target, vars, position = self.__queue.get_nowait()
+			except queue.Empty:
+				break
+			self.to(target, vars, position)
+		events, schedule, starts, _ = stream['compiled']
+		for t in self.__timeline[stream['added']:]:
+			event, progress = self.__compileEvent(t, stream['progresses'])
+			s = stream['next']
+			starts.setdefault(event.start, []).append(s)
+			schedule[s] = (event.start, event.end, progress, s, False)
+			events[s] = event
+			stream['next'] += 1
+			stream['end'] = max(stream['end'], event.end)
+		self.__retire(stream['step'])
+		stream['added'] = len(self.__timeline)
+		request = stream['run'].send(None)
+		while request is not None:
+			request = stream['run'].send(coppelia.getStates(request, stream['writer']))
+		stream['step'] += 1
+		return stream['step'] <= stream['end']
+
+	def __retire(self, step: int):
+		"""Forget the animations of a streaming timeline that have ended before a step, and their intervals in the target index.
+		New animations never start before the current step, so they cannot overlap with them
+		Args:
+			step (int): The current step
+		"""
+		sps = self.__options['control_rate']
+		self.__timeline = [t for t in self.__timeline if round(t.end * sps) >= step]
+		now = step / sps
+		for target in list(self.__intervals):
+			intervals = self.__intervals[target]
+			k = 0
+			while k < len(intervals) and intervals[k][1] < now:
+				k += 1
+			if k == len(intervals):
+				del self.__intervals[target]
+			elif k > 0:
+				del intervals[:k]
+
+	def stop(self) -> 'Timeline':
+		"""Stop the streaming mode started by step_once, calling the onComplete callback. The timeline is reset, so the animations
+		that were added or enqueued are discarded and the next step_once starts a new stream from an empty timeline
+		Returns:
+			Timeline: The timeline object
+		"""
+		if self.__stream is None:
+			return self
+		run = self.__stream['run']
+		self.__stream = None
+		self.__timeline = []
+		self.__intervals = {}
+		self.__duration = 0
+		self.__previousStart = 0
+		self.__previousEnd = 0
+		self.__previousDuration = 0
+		self.__compiled = None
+		while True:
+			try:
+				self.__queue.get_nowait()
+			except queue.Empty:
+				break
+		try:
+			run.send(False)
+		except StopIteration:
+			pass
+		return self
+
+	@property
+	def dropped(self) -> int:
+		"""The number of callbacks dropped because the callback queue was full"""
+		return self.__dispatcher.dropped if self.__dispatcher is not None else 0
+
+	def snapshot(self) -> dict:
+		"""Read the current state of every target of the timeline
+		Returns:
+			dict: The state of each target, as {target: {'position': [x, y, z], 'rotation': [x, y, z], 'angle': angle, 'quaternion': [x, y, z, w]}}
+		"""
+		snapshot = {}
+		for t in self.__timeline:
+			state = snapshot.setdefault(t.target, {})
+			if t.channels & CHANNEL_POSITION and 'position' not in state:
+				state['position'] = self._sim.getObjectPosition(t.target)
+			if t.channels & CHANNEL_ROTATION and 'rotation' not in state:
+				state['rotation'] = self._sim.getObjectOrientation(t.target)
+			if t.channels & CHANNEL_ANGLE and 'angle' not in state:
+				state['angle'] = self._sim.getJointTargetPosition(t.target)
+			if t.channels & CHANNEL_QUATERNION and 'quaternion' not in state:
+				state['quaternion'] = self._sim.getObjectQuaternion(t.target)
+		return snapshot
+
+	def render(self, path: str, snapshot: dict) -> 'Timeline':
+		"""Render the timeline offline into a trajectory file, without any remote call
+		Args:
+			path (str): The path of the trajectory file
+			snapshot (dict): The initial state of each target (see snapshot)
+		Returns:
+			Timeline: The timeline object
+		"""
+		if self.__compiled is None:
+			self.compile()
+		events = self.__compiled[0]
+		channels = []
+		for t in events:
+			for kind in trajectory.KINDS:
+				if getattr(t, kind) is None or (t.target, kind) in channels:
+					continue
+				if t.target not in snapshot or kind not in snapshot[t.target]:
+					raise Exception(f'Snapshot is missing the {kind} of "{t.name}"')
+				channels.append((t.target, kind))
+		names = {t.target: t.name for t in events}
+		steps = (self.__compiled[3] + 1) * (self.__options['sim_rate'] // self.__options['control_rate'])
+		recorder = trajectory.TrajectoryRecorder(path, [(h, names[h], k) for h, k in channels], snapshot, steps, self.__options['sim_rate'])
+		self.__drive(self.__run(recorder, False, self.__compiled), recorder)
+		recorder.close()
+		return self
+
+	@staticmethod
+	def __drive(run, reader):
+		"""Drive a timeline run synchronously, answering its read requests
+		Args:
+			run (generator): The timeline run
+			reader (RemoteAPIServer): The object used to read the initial states
+		"""
+		try:
+			request = next(run)
+			while True:
+				request = run.send(None if request is None else coppelia.getStates(request, reader))
+		except StopIteration:
+			pass
+
+	def __run(self, writer, callbacks: bool, compiled: tuple):
+		"""Run the compiled timeline step by step. The run is a generator that yields the list of (handle, kind)
+		states to read when events start, expecting their values back, and None after every simulation step.
+		Without duration, the run never ends until False is sent after a step, and new events can be added to the schedule while it runs.
+		In that case the events, the schedule and the starts are dictionaries, and the run deletes the entries of the events that have ended.
+		An event starting at step s and ending at step e writes its setpoints from s + 1 to e, the last one being
+		exactly its final value. Events without duration write their final value on their start step.
+		All the state of the run is kept here, so the compiled timeline is never modified
+		Args:
+			writer (RemoteAPIServer): The object used to write the setpoints and step the simulation
+			callbacks (bool): If the callbacks should be executed
+			compiled (tuple): The events, the schedule, the table of starts and the duration in steps
+		"""
+		events, schedule, starts, duration = compiled
+		sps = self.__options['control_rate']
+		substeps = self.__options['sim_rate'] // sps
+		profiler = self.__options['profiler']
+		hooks = {key: self.__options[key] for key in ('onStart', 'onUpdate', 'onStep', 'onComplete') if callbacks and key in self.__options}
+		if self.__dispatcher is not None:
+			hooks = {key: self.__dispatcher.defer(hook, key in ('onUpdate', 'onStep')) for key, hook in hooks.items()}
+		if profiler is not None:
+			hooks = {key: profiler.timed(hook) for key, hook in hooks.items()}
 		if self.__options['debug']:
-			for i in range(len(timeline)):
-				t = timeline[i]
-				s = int(t['start'] / sps * 100) / 100
-				e = int(t['end'] / sps * 100) / 100
-				d = int(t['duration'] / sps * 100) / 100
-				print(f'INFO: Event {i+1}: {t["name"]} -> Start: {s}, End: {e}, Duration: {d}')
+			for s in range(len(schedule)):
+				start, end = schedule[s][:2]
+				t = events[schedule[s][3]]
+				s_ = int(start / sps * 100) / 100
+				e = int(end / sps * 100) / 100
+				d = int(t.duration / sps * 100) / 100
+				print(f'INFO: Event {s+1}: {t.name} -> Start: {s_}, End: {e}, Duration: {d}')
 			print('')
-		duration = math.ceil(duration)
-		nTimelines = len(timeline)
 		isDebug = self.__options['debug']
-		if 'onStart' in self.__options:
-			self.__options['onStart']()
-		for i in range(duration + 1):
+		tolerance = self.__options['tolerance']
+		initials = {}
+		values = {}
+		updated = None
+		latest = {}
+		finished = []
+
+		def update(s: int, i: int, isDebugTime: bool) -> bool:
+			start, end, progress, j, reverse = schedule[s]
+			event = events[j]
+			if progress is not None:
+				k = i - start - 1
+				positions, rotations, angles, quaternions = values[s]
+				position = positions[k] if positions is not None else None
+				rotation = rotations[k] if rotations is not None else None
+				angle = angles[k] if angles is not None else None
+				quaternion = quaternions[k] if quaternions is not None else None
+				if position is not None:
+					if isDebugTime:
+						print(f'INFO: {event.name} position is: {position[0]}, {position[1]}, {position[2]}')
+					if quaternion is not None:
+						writer.setObjectPose(event.target, position + quaternion)
+					else:
+						writer.setObjectPosition(event.target, position)
+				if quaternion is not None:
+					if isDebugTime:
+						print(f'INFO: {event.name} quaternion is: {quaternion[0]}, {quaternion[1]}, {quaternion[2]}, {quaternion[3]}')
+					if position is None:
+						writer.setObjectQuaternion(event.target, quaternion)
+				if rotation is not None:
+					if isDebugTime:
+						print(f'INFO: {event.name} rotation is: {rotation[0]}, {rotation[1]}, {rotation[2]}')
+					writer.setObjectOrientation(event.target, rotation)
+				if angle is not None:
+					if isDebugTime:
+						deg = self.rad2deg(angle)
+						rad = int(angle * 10000) / 10000
+						deg = int(deg * 100) / 100
+						print(f'INFO: {event.name} angle is: {deg}° ({rad} rad)')
+					writer.setJointTargetPosition(event.target, angle)
+				if updated is not None:
+					state = latest[s]
+					for key, value in (('position', position), ('rotation', rotation), ('angle', angle), ('quaternion', quaternion)):
+						if value is not None:
+							state[key] = value
+					updated.append((event.target, dict(state)))
+			elif i < end:
+				return True
+			if callbacks and event.onUpdate is not None:
+				event.onUpdate(event.target)
+			if i < end:
+				return True
+			values.pop(s, None)
+			latest.pop(s, None)
+			if callbacks and event.onEnd is not None:
+				event.onEnd(event.target)
+			if isDebug:
+				initial = initials[j]
+				if event.position is not None:
+					p = list(initial[0] if reverse else event.position)
+					p[0] = int(p[0] * 100) / 100
+					p[1] = int(p[1] * 100) / 100
+					p[2] = int(p[2] * 100) / 100
+					print(f'INFO: {event.name} position has ended at: {p[0]}, {p[1]}, {p[2]}')
+				if event.rotation is not None:
+					r = list(initial[1] if reverse else event.rotation)
+					r[0] = int(r[0] * 100) / 100
+					r[1] = int(r[1] * 100) / 100
+					r[2] = int(r[2] * 100) / 100
+					print(f'INFO: {event.name} rotation has ended at: {r[0]}, {r[1]}, {r[2]}')
+				if event.angle is not None:
+					angle = initial[2] if reverse else event.angle
+					deg = self.rad2deg(angle)
+					rad = int(angle * 10000) / 10000
+					deg = int(deg * 100) / 100
+					print(f'INFO: {event.name} angle has ended at: {deg}° ({rad} rad)')
+				if event.quaternion is not None:
+					q = [int(x * 10000) / 10000 for x in (initial[3] if reverse else event.quaternion)]
+					print(f'INFO: {event.name} quaternion has ended at: {q[0]}, {q[1]}, {q[2]}, {q[3]}')
+			finished.append(s)
+			return False
+
+		active = []
+		if 'onStart' in hooks:
+			hooks['onStart']()
+		for i in range(duration + 1) if duration is not None else itertools.count():
+			if profiler is not None:
+				profiler.begin(i)
 			isDebugTime = False
 			if isDebug and i % (sps // self.__options['debugs_per_second']) == 0:
 				isDebugTime = True
-			for j in range(nTimelines):
-				event = timeline[j]
-				if i == event['start']:
-					if 'position' in event['vars']:
-						if 'forcedFinalPosition' in event:
-							event["initialPosition"] = event["vars"]["position"]
-							event["vars"]["position"] = event["forcedFinalPosition"]
-						else:
-							initialPosition = self._sim.getObjectPosition(event['target'])
-							event["initialPosition"] = initialPosition
-							if self.__options['yoyo'] and j < nTimelines // 2:
-								timeline[nTimelines - j - 1]["forcedFinalPosition"] = initialPosition
-						if isDebug:
-							p = event["initialPosition"].copy()
-							p[0] = int(p[0] * 100) / 100
-							p[1] = int(p[1] * 100) / 100
-							p[2] = int(p[2] * 100) / 100
-							print(f'INFO: {event["name"]} position has started at: {p[0]}, {p[1]}, {p[2]}')
-					if 'rotation' in event['vars']:
-						if 'forcedFinalRotation' in event:
-							event["initialRotation"] = event["vars"]["rotation"]
-							event["vars"]["rotation"] = event["forcedFinalRotation"]
-						else:
-							initialRotation = self._sim.getObjectOrientation(event['target'])
-							event["initialRotation"] = initialRotation
-							if self.__options['yoyo'] and j < nTimelines // 2:
-								timeline[nTimelines - j - 1]["forcedFinalRotation"] = initialRotation
-						if isDebug:
-							r = event["initialRotation"].copy()
-							r[0] = int(r[0] * 100) / 100
-							r[1] = int(r[1] * 100) / 100
-							r[2] = int(r[2] * 100) / 100
-							print(f'INFO: {event["name"]} rotation has started at: {r[0]}, {r[1]}, {r[2]}')
-					if 'angle' in event['vars']:
-						if 'forcedFinalAngle' in event:
-							event["initialAngle"] = event["vars"]["angle"]
-							event["vars"]["angle"] = event["forcedFinalAngle"]
-						else:
-							initialAngle = self._sim.getJointTargetPosition(event['target'])
-							event["initialAngle"] = initialAngle
-							if self.__options['yoyo'] and j < nTimelines // 2:
-								timeline[nTimelines - j - 1]["forcedFinalAngle"] = initialAngle
-						if isDebug:
-							deg = self.rad2deg(event["initialAngle"])
-							rad = int(event["initialAngle"] * 10000) / 10000
-							deg = int(deg * 100) / 100
-							print(f'INFO: {event["name"]} angle has started at: {deg}° ({rad} rad)')
-					if 'onStart' in event['vars']:
-						event['vars']['onStart'](event['target'])
-				elif i > event['start'] and i < event['end'] and ('position' in event['vars'] or 'rotation' in event['vars'] or 'angle' in event['vars']):
-					ease = event['vars']['ease']
-					if 'position' in event['vars']:
-						position = event['vars']['position']
-						t = (i - event['start']) / event['duration']
-						t = ease(t)
-						x = position[0] * t + event["initialPosition"][0] * (1 - t)
-						y = position[1] * t + event["initialPosition"][1] * (1 - t)
-						z = position[2] * t + event["initialPosition"][2] * (1 - t)
-						if isDebugTime:
-							print(f'INFO: {event["name"]} position is: {x}, {y}, {z}')
-						self._sim.setObjectPosition(event['target'], [x, y, z])
-					if 'rotation' in event['vars']:
-						rotation = event['vars']['rotation']
-						t = (i - event['start']) / event['duration']
-						t = ease(t)
-						x = rotation[0] * t + event["initialRotation"][0] * (1 - t)
-						y = rotation[1] * t + event["initialRotation"][1] * (1 - t)
-						z = rotation[2] * t + event["initialRotation"][2] * (1 - t)
-						if isDebugTime:
-							print(f'INFO: {event["name"]} rotation is: {x}, {y}, {z}')
-						self._sim.setObjectOrientation(event['target'], [x, y, z])
-					if 'angle' in event['vars']:
-						angle = event['vars']['angle']
-						t = (i - event['start']) / event['duration']
-						t = ease(t)
-						angle = angle * t + event["initialAngle"] * (1 - t)
-						if isDebugTime:
-							deg = self.rad2deg(angle)
-							rad = int(angle * 10000) / 10000
-							deg = int(deg * 100) / 100
-							print(f'INFO: {event["name"]} angle is: {deg}° ({rad} rad)')
-						self._sim.setJointTargetPosition(event['target'], angle)
-					if 'onUpdate' in event['vars']:
-						event['vars']['onUpdate'](event['target'])
-				elif i == event['end']:
-					if 'onUpdate' in event['vars']:
-						event['vars']['onUpdate'](event['target'])
-					if 'onEnd' in event['vars']:
-						event['vars']['onEnd'](event['target'])
-					if isDebug:
-						if 'position' in event['vars']:
-							p = event['vars']['position'].copy()
-							p[0] = int(p[0] * 100) / 100
-							p[1] = int(p[1] * 100) / 100
-							p[2] = int(p[2] * 100) / 100
-							print(f'INFO: {event["name"]} position has ended at: {p[0]}, {p[1]}, {p[2]}')
-						if 'rotation' in event['vars']:
-							r = event['vars']['rotation'].copy()
-							r[0] = int(r[0] * 100) / 100
-							r[1] = int(r[1] * 100) / 100
-							r[2] = int(r[2] * 100) / 100
-							print(f'INFO: {event["name"]} rotation has ended at: {r[0]}, {r[1]}, {r[2]}')
-						if 'angle' in event['vars']:
-							deg = self.rad2deg(event['vars']['angle'])
-							rad = int(event['vars']['angle'] * 10000) / 10000
-							deg = int(deg * 100) / 100
-							print(f'INFO: {event["name"]} angle has ended at: {deg}° ({rad} rad)')
-			if 'onUpdate' in self.__options:
-				self.__options['onUpdate']()
-			self._sim.step()
-		if 'onComplete' in self.__options:
-			self.__options['onComplete']()
-		return self
\ No newline at end of file
+			if 'onStep' in hooks:
+				updated = []
+			running = [s for s in active if update(s, i, isDebugTime)]
+			starting = starts.get(i, ())
+			requests = []
+			for s in starting:
+				if schedule[s][4]:
+					continue
+				event = events[schedule[s][3]]
+				if event.position is not None:
+					requests.append((event.target, coppelia.KIND_POSITION))
+				if event.rotation is not None:
+					requests.append((event.target, coppelia.KIND_ORIENTATION))
+				if event.angle is not None:
+					requests.append((event.target, coppelia.KIND_ANGLE))
+				if event.quaternion is not None:
+					requests.append((event.target, coppelia.KIND_QUATERNION))
+			if len(requests) > 0:
+				states = dict(zip(requests, (yield requests)))
+			for s in starting:
+				start, end, progress, j, reverse = schedule[s]
+				event = events[j]
+				if not reverse:
+					initials[j] = (
+						states[(event.target, coppelia.KIND_POSITION)] if event.position is not None else None,
+						states[(event.target, coppelia.KIND_ORIENTATION)] if event.rotation is not None else None,
+						states[(event.target, coppelia.KIND_ANGLE)] if event.angle is not None else None,
+						states[(event.target, coppelia.KIND_QUATERNION)] if event.quaternion is not None else None
+					)
+				initial = initials[j]
+				if progress is not None:
+					paths = event.paths if event.paths is not None else {}
+					values[s] = (
+						self.__interpolate(initial[0], event.position, progress, tolerance.get('position'), paths.get(CHANNEL_POSITION), event.spline, event.position if reverse else None) if event.position is not None else None,
+						self.__interpolate(initial[1], event.rotation, progress, tolerance.get('rotation'), paths.get(CHANNEL_ROTATION), event.spline, event.rotation if reverse else None) if event.rotation is not None else None,
+						self.__interpolate(initial[2], event.angle, progress, tolerance.get('angle'), paths.get(CHANNEL_ANGLE), event.spline, event.angle if reverse else None) if event.angle is not None else None,
+						self.__rows(self.slerp(initial[3], event.quaternion, 1.0) if reverse else np.asarray(initial[3], dtype=float), self.slerp(initial[3], event.quaternion, progress), tolerance.get('quaternion')) if event.quaternion is not None else None
+					)
+					if 'onStep' in hooks:
+						origins = (event.position, event.rotation, event.angle, event.quaternion) if reverse else initial
+						latest[s] = {key: origin for key, origin, final in zip(('position', 'rotation', 'angle', 'quaternion'), origins, (event.position, event.rotation, event.angle, event.quaternion)) if final is not None}
+				if isDebug:
+					if event.position is not None:
+						p = list(event.position if reverse else initial[0])
+						p[0] = int(p[0] * 100) / 100
+						p[1] = int(p[1] * 100) / 100
+						p[2] = int(p[2] * 100) / 100
+						print(f'INFO: {event.name} position has started at: {p[0]}, {p[1]}, {p[2]}')
+					if event.rotation is not None:
+						r = list(event.rotation if reverse else initial[1])
+						r[0] = int(r[0] * 100) / 100
+						r[1] = int(r[1] * 100) / 100
+						r[2] = int(r[2] * 100) / 100
+						print(f'INFO: {event.name} rotation has started at: {r[0]}, {r[1]}, {r[2]}')
+					if event.angle is not None:
+						angle = event.angle if reverse else initial[2]
+						deg = self.rad2deg(angle)
+						rad = int(angle * 10000) / 10000
+						deg = int(deg * 100) / 100
+						print(f'INFO: {event.name} angle has started at: {deg}° ({rad} rad)')
+					if event.quaternion is not None:
+						q = [int(x * 10000) / 10000 for x in (event.quaternion if reverse else initial[3])]
+						print(f'INFO: {event.name} quaternion has started at: {q[0]}, {q[1]}, {q[2]}, {q[3]}')
+				if callbacks and event.onStart is not None:
+					event.onStart(event.target)
+				if end > start or update(s, i, isDebugTime):
+					running.append(s)
+			active = running
+			for s in finished:
+				j = schedule[s][3]
+				if not self.__options['yoyo']:
+					initials.pop(j, None)
+				if duration is None:
+					del schedule[s]
+					del events[j]
+			finished.clear()
+			if duration is None:
+				starts.pop(i, None)
+			if 'onStep' in hooks:
+				hooks['onStep'](updated)
+			if 'onUpdate' in hooks:
+				hooks['onUpdate']()
+			for _ in range(substeps):
+				writer.step()
+			if profiler is not None:
+				profiler.end()
+			if (yield None) is False:
+				break
+		if 'onComplete' in hooks:
+			hooks['onComplete']()
+		if self.__dispatcher is not None:
+			self.__dispatcher.join()
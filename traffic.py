@@ -0,0 +1,288 @@
+# Copyright (c) 2024 Xavi Burgos
+#
+# Licensed under the MIT License. See LICENSE file in the project root for full
+# license information. Permission is granted to use, copy, modify, and distribute
+# this software for any purpose with or without fee, subject to the above
+# copyright notice and this permission notice.
+
+import sys
+import time
+import struct
+import collections
+import numpy as np
+
+try:
+	import cbor2 as cbor
+except ModuleNotFoundError:
+	import cbor
+
+MAGIC = b'CTRF\x00\x00\x00\x01'
+CALL = 0
+CONSTANT = 1
+ERROR = 2
+
+def _plain(value):
+	"""Convert the NumPy values of a remote call to plain Python values, like the remote API client does
+	Args:
+		value (any): The value
+	Returns:
+		any: The plain value, with tuples as lists
+	"""
+	if isinstance(value, np.ndarray):
+		return value.tolist()
+	if isinstance(value, np.generic):
+		return value.item()
+	if isinstance(value, (list, tuple)):
+		return [_plain(v) for v in value]
+	return value
+
+def _key(name: str, args) -> str:
+	"""Get the name a remote call is counted as, the helper function name for script functions
+	Args:
+		name (str): The remote function name
+		args (list): The arguments of the call
+	Returns:
+		str: The counted name
+	"""
+	return args[0] if name == 'callScriptFunction' else name
+
+def read(path: str):
+	"""Read the records of a traffic log, stopping at the last complete one
+	Args:
+		path (str): The path of the traffic log
+	Returns:
+		generator: The records, as [kind, name, args, value, elapsed] lists, where kind is CALL, CONSTANT or ERROR
+	"""
+	with open(path, 'rb') as f:
+		if f.read(len(MAGIC)) != MAGIC:
+			raise Exception(f'"{path}" is not a traffic log')
+		while True:
+			header = f.read(4)
+			if len(header) < 4:
+				break
+			length = struct.unpack('<I', header)[0]
+			data = f.read(length)
+			if len(data) < length:
+				break
+			yield cbor.loads(data)
+
+class RecordingSim:
+
+	def __init__(self, sim, path: str):
+		"""Create a proxy of a sim object that writes every remote call, with its arguments, result and latency, to a traffic log
+		Args:
+			sim (RemoteAPIServer): The sim object
+			path (str): The path of the traffic log
+		"""
+		self.sim = sim
+		self.file = open(path, 'wb')
+		self.file.write(MAGIC)
+
+	def __write(self, record: list):
+		"""Append a length-prefixed record to the log
+		Args:
+			record (list): The record, as [kind, name, args, value, elapsed]
+		"""
+		data = cbor.dumps(record)
+		self.file.write(struct.pack('<I', len(data)))
+		self.file.write(data)
+
+	def __getattr__(self, name: str):
+		"""Get a constant or a recorded function of the sim object
+		Args:
+			name (str): The attribute name
+		Returns:
+			any: The constant, or the recorded function
+		"""
+		attr = getattr(self.sim, name)
+		write = self.__write
+		if not callable(attr):
+			write([CONSTANT, name, None, _plain(attr), None])
+			setattr(self, name, attr)
+			return attr
+		def function(*args):
+			start = time.perf_counter()
+			try:
+				result = attr(*args)
+			except Exception as error:
+				write([ERROR, name, _plain(args), str(error), time.perf_counter() - start])
+				raise
+			write([CALL, name, _plain(args), _plain(result), time.perf_counter() - start])
+			return result
+		setattr(self, name, function)
+		return function
+
+	def close(self):
+		"""Close the traffic log"""
+		self.file.close()
+
+class ReplaySim:
+
+	def __init__(self, path: str, options: dict = {}):
+		"""Create a sim object that answers the remote calls with the results of a traffic log, without CoppeliaSim
+		Args:
+			path (str): The path of the traffic log
+			options (dict): The replay options
+		"""
+		self.__options = options
+		if 'strict' not in self.__options:
+			self.__options['strict'] = True
+		elif type(self.__options['strict']) != bool:
+			raise Exception('"strict" option must be a boolean')
+		if 'timing' not in self.__options:
+			self.__options['timing'] = False
+		elif type(self.__options['timing']) != bool:
+			raise Exception('"timing" option must be a boolean')
+		self.calls = collections.Counter()
+		self.steps = 0
+		self.__constants = {}
+		self.__records = []
+		self.__queues = collections.defaultdict(collections.deque)
+		self.__silent = set()
+		self.__next = 0
+		for record in read(path):
+			if record[0] == CONSTANT:
+				self.__constants[record[1]] = record[3]
+			elif self.__options['strict']:
+				self.__records.append(record)
+			else:
+				self.__queues[_key(record[1], record[2])].append(record)
+		for key, records in self.__queues.items():
+			if all(record[0] == CALL and record[3] is None for record in records):
+				self.__silent.add(key)
+
+	def __replay(self, name: str, args: tuple):
+		"""Answer a remote call with the next recorded one. In strict mode, the calls must come in the same order and with the same
+		arguments as in the log. Otherwise, every function answers with its own recorded results in order, and the functions that never
+		returned anything, like the setters, can be called any number of times
+		Args:
+			name (str): The remote function name
+			args (tuple): The arguments of the call
+		Returns:
+			any: The recorded result
+		"""
+		key = _key(name, args)
+		if self.__options['strict']:
+			if self.__next >= len(self.__records):
+				raise Exception(f'The traffic log has no more calls, but "{key}" was called')
+			record = self.__records[self.__next]
+			if record[1] != name or record[2] != _plain(args):
+				raise Exception(f'Call {self.__next} should be "{_key(record[1], record[2])}" with the recorded arguments, but it is "{key}"')
+			self.__next += 1
+		elif len(self.__queues[key]) > 0:
+			record = self.__queues[key].popleft()
+		elif key in self.__silent:
+			record = [CALL, name, None, None, 0.0]
+		else:
+			raise Exception(f'The traffic log has no more calls to "{key}"')
+		self.calls[key] += 1
+		if name == 'step':
+			self.steps += 1
+		if self.__options['timing']:
+			end = time.perf_counter() + record[4]
+			while time.perf_counter() < end:
+				pass
+		if record[0] == ERROR:
+			raise Exception(record[3])
+		return record[3]
+
+	def __getattr__(self, name: str):
+		"""Get a recorded constant or a replayed function
+		Args:
+			name (str): The attribute name
+		Returns:
+			any: The constant, or the replayed function
+		"""
+		if name.startswith('_'):
+			raise AttributeError(name)
+		if name in self.__constants:
+			return self.__constants[name]
+		replay = self.__replay
+		def function(*args):
+			return replay(name, args)
+		setattr(self, name, function)
+		return function
+
+	def done(self) -> bool:
+		"""Check if all the recorded calls have been replayed
+		Returns:
+			bool: True if no recorded call is left
+		"""
+		if self.__options['strict']:
+			return self.__next == len(self.__records)
+		return all(len(records) == 0 for key, records in self.__queues.items() if key not in self.__silent)
+
+def callsPerStep(path: str) -> list:
+	"""Count the remote calls of every simulation step of a traffic log, each step ending with its sim.step() call
+	Args:
+		path (str): The path of the traffic log
+	Returns:
+		list: The number of calls of every function, as a Counter per step
+	"""
+	steps = [collections.Counter()]
+	for kind, name, args, value, elapsed in read(path):
+		if kind == CONSTANT:
+			continue
+		steps[-1][_key(name, args)] += 1
+		if name == 'step':
+			steps.append(collections.Counter())
+	if len(steps[-1]) == 0:
+		steps.pop()
+	return steps
+
+def summary(path: str) -> dict:
+	"""Get the totals of a traffic log
+	Args:
+		path (str): The path of the traffic log
+	Returns:
+		dict: The number of steps, the calls and the time spent in every function, and the calls per step
+	"""
+	calls = collections.Counter()
+	times = collections.Counter()
+	steps = 0
+	for kind, name, args, value, elapsed in read(path):
+		if kind == CONSTANT:
+			continue
+		key = _key(name, args)
+		calls[key] += 1
+		times[key] += elapsed
+		if name == 'step':
+			steps += 1
+	return {
+		'steps': steps,
+		'calls': dict(calls),
+		'times': dict(times),
+		'calls_per_step': sum(calls.values()) / steps if steps > 0 else 0
+	}
+
+def diff(a: str, b: str) -> list:
+	"""Compare the calls per step of two traffic logs, for example recorded with two versions of the library
+	Args:
+		a (str): The path of the first traffic log
+		b (str): The path of the second traffic log
+	Returns:
+		list: The differences, as (step, name, calls in a, calls in b) tuples
+	"""
+	stepsA = callsPerStep(a)
+	stepsB = callsPerStep(b)
+	empty = collections.Counter()
+	differences = []
+	for step in range(max(len(stepsA), len(stepsB))):
+		countsA = stepsA[step] if step < len(stepsA) else empty
+		countsB = stepsB[step] if step < len(stepsB) else empty
+		for name in sorted(set(countsA) | set(countsB)):
+			if countsA[name] != countsB[name]:
+				differences.append((step, name, countsA[name], countsB[name]))
+	return differences
+
+if __name__ == '__main__':
+	if len(sys.argv) == 3 and sys.argv[1] == 'summary':
+		print(summary(sys.argv[2]))
+	elif len(sys.argv) == 4 and sys.argv[1] == 'diff':
+		differences = diff(sys.argv[2], sys.argv[3])
+		print(f'{"step":>8}  {"function":<28}{"a":>8}{"b":>8}')
+		for step, name, countA, countB in differences:
+			print(f'{step:>8}  {name:<28}{countA:>8}{countB:>8}')
+		print(f'{len(differences)} differences')
+	else:
+		print('Usage: python traffic.py summary <log> | python traffic.py diff <log a> <log b>')
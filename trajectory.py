@@ -0,0 +1,274 @@
+# Copyright (c) 2024 Xavi Burgos
+#
+# Licensed under the MIT License. See LICENSE file in the project root for full
+# license information. Permission is granted to use, copy, modify, and distribute
+# this software for any purpose with or without fee, subject to the above
+# copyright notice and this permission notice.
+
+import json
+import struct
+import numpy as np
+import coppelia
+
+MAGIC = b'CTRJ\x00\x00\x00\x01'
+ALIGNMENT = 64
+KINDS = ('position', 'rotation', 'angle', 'quaternion')
+SIZES = {'position': 3, 'rotation': 3, 'angle': 1, 'quaternion': 4}
+
+def _layout(header: dict) -> tuple:
+	"""Compute the offsets of the data and mask blocks
+	Args:
+		header (dict): The trajectory header
+	Returns:
+		tuple: The encoded header, the data offset, the mask offset and the total size
+	"""
+	encoded = json.dumps(header).encode('utf-8')
+	offset = len(MAGIC) + 8 + len(encoded)
+	offset += -offset % ALIGNMENT
+	mask = offset + header['steps'] * header['columns'] * 8
+	mask += -mask % ALIGNMENT
+	size = mask + header['steps'] * len(header['channels'])
+	return encoded, offset, mask, size
+
+class Trajectory:
+
+	def __init__(self, path: str):
+		"""Open a trajectory file as read-only memory-mapped arrays
+		Args:
+			path (str): The path of the trajectory file
+		"""
+		with open(path, 'rb') as f:
+			if f.read(len(MAGIC)) != MAGIC:
+				raise Exception(f'"{path}" is not a trajectory file')
+			length = struct.unpack('<Q', f.read(8))[0]
+			self.header = json.loads(f.read(length).decode('utf-8'))
+		_, offset, mask, _ = _layout(self.header)
+		self.path = path
+		self.channels = self.header['channels']
+		self.steps = self.header['steps']
+		self.steps_per_second = self.header['steps_per_second']
+		self.data = np.memmap(path, dtype='<f8', mode='r', offset=offset, shape=(self.steps, self.header['columns']))
+		self.mask = np.memmap(path, dtype=np.uint8, mode='r', offset=mask, shape=(self.steps, len(self.channels)))
+
+class TrajectoryRecorder:
+
+	def __init__(self, path: str, channels: list, snapshot: dict, steps: int, steps_per_second: int):
+		"""Create a trajectory file and record the setpoints written into it
+		Args:
+			path (str): The path of the trajectory file
+			channels (list): The recorded channels, as (handle, name, kind) tuples
+			snapshot (dict): The initial state of each target, as {handle: {kind: value}}
+			steps (int): The number of steps of the trajectory
+			steps_per_second (int): The number of steps per second
+		"""
+		header = {'steps': steps, 'steps_per_second': steps_per_second, 'columns': 0, 'channels': []}
+		self.__columns = {}
+		for handle, name, kind in channels:
+			if kind not in SIZES:
+				raise Exception(f'"{kind}" is not a valid channel kind')
+			self.__columns[(handle, kind)] = (header['columns'], len(header['channels']))
+			header['channels'].append({'handle': handle, 'name': name, 'kind': kind, 'column': header['columns'], 'size': SIZES[kind]})
+			header['columns'] += SIZES[kind]
+		encoded, offset, mask, size = _layout(header)
+		with open(path, 'wb') as f:
+			f.write(MAGIC)
+			f.write(struct.pack('<Q', len(encoded)))
+			f.write(encoded)
+			f.truncate(size)
+		self.__data = np.memmap(path, dtype='<f8', mode='r+', offset=offset, shape=(steps, header['columns']))
+		self.__mask = np.memmap(path, dtype=np.uint8, mode='r+', offset=mask, shape=(steps, len(header['channels'])))
+		self.__row = np.zeros(header['columns'])
+		self.__flags = np.zeros(len(header['channels']), dtype=np.uint8)
+		self.__step = 0
+		for (handle, kind), (column, _) in self.__columns.items():
+			self.__row[column:column + SIZES[kind]] = snapshot[handle][kind]
+
+	def __set(self, handle: int, kind: str, value):
+		"""Write the value of a channel in the current row
+		Args:
+			handle (int): The object handle
+			kind (str): The channel kind
+			value (float | list): The value
+		"""
+		column, index = self.__columns[(handle, kind)]
+		self.__row[column:column + SIZES[kind]] = value
+		self.__flags[index] = 1
+
+	def getObjectPosition(self, handle: int) -> list:
+		"""Get the recorded position of an object
+		Args:
+			handle (int): The object handle
+		Returns:
+			list: The position [x, y, z]
+		"""
+		column = self.__columns[(handle, 'position')][0]
+		return self.__row[column:column + 3].tolist()
+
+	def getObjectOrientation(self, handle: int) -> list:
+		"""Get the recorded orientation of an object
+		Args:
+			handle (int): The object handle
+		Returns:
+			list: The Euler angles [alpha, beta, gamma]
+		"""
+		column = self.__columns[(handle, 'rotation')][0]
+		return self.__row[column:column + 3].tolist()
+
+	def getJointTargetPosition(self, handle: int) -> float:
+		"""Get the recorded target position of a joint
+		Args:
+			handle (int): The joint handle
+		Returns:
+			float: The target position
+		"""
+		return float(self.__row[self.__columns[(handle, 'angle')][0]])
+
+	def getObjectQuaternion(self, handle: int) -> list:
+		"""Get the recorded quaternion of an object
+		Args:
+			handle (int): The object handle
+		Returns:
+			list: The quaternion [x, y, z, w]
+		"""
+		column = self.__columns[(handle, 'quaternion')][0]
+		return self.__row[column:column + 4].tolist()
+
+	def setObjectPosition(self, handle: int, position: list):
+		"""Record the position of an object
+		Args:
+			handle (int): The object handle
+			position (list): The position [x, y, z]
+		"""
+		self.__set(handle, 'position', position)
+
+	def setObjectOrientation(self, handle: int, orientation: list):
+		"""Record the orientation of an object
+		Args:
+			handle (int): The object handle
+			orientation (list): The Euler angles [alpha, beta, gamma]
+		"""
+		self.__set(handle, 'rotation', orientation)
+
+	def setJointTargetPosition(self, handle: int, angle: float):
+		"""Record the target position of a joint
+		Args:
+			handle (int): The joint handle
+			angle (float): The target position
+		"""
+		self.__set(handle, 'angle', angle)
+
+	def setObjectQuaternion(self, handle: int, quaternion: list):
+		"""Record the quaternion of an object
+		Args:
+			handle (int): The object handle
+			quaternion (list): The quaternion [x, y, z, w]
+		"""
+		self.__set(handle, 'quaternion', quaternion)
+
+	def setObjectPose(self, handle: int, pose: list):
+		"""Record the position and the quaternion of an object
+		Args:
+			handle (int): The object handle
+			pose (list): The pose [x, y, z, qx, qy, qz, qw]
+		"""
+		self.__set(handle, 'position', pose[:3])
+		self.__set(handle, 'quaternion', pose[3:])
+
+	def step(self):
+		"""Store the current row and move to the next step"""
+		self.__data[self.__step] = self.__row
+		self.__mask[self.__step] = self.__flags
+		self.__flags[:] = 0
+		self.__step += 1
+
+	def close(self):
+		"""Flush the recorded steps to the trajectory file"""
+		self.__data.flush()
+		self.__mask.flush()
+		del self.__data
+		del self.__mask
+
+class TrajectoryPlayer:
+
+	def __init__(self, sim, path: str, options: dict = {}):
+		"""Create a player that streams a trajectory file into the simulation
+		Args:
+			sim (RemoteAPIServer): The sim object
+			path (str): The path of the trajectory file
+			options (dict): The player options
+		"""
+		self._sim = sim
+		self.__options = options
+		if 'rate' not in self.__options:
+			self.__options['rate'] = 1.0
+		elif type(self.__options['rate']) != int and type(self.__options['rate']) != float:
+			raise Exception('"rate" option must be a number')
+		elif self.__options['rate'] <= 0:
+			raise Exception('"rate" option must be greater than 0')
+		if 'loop' not in self.__options:
+			self.__options['loop'] = 1
+		elif type(self.__options['loop']) != int:
+			raise Exception('"loop" option must be an integer')
+		elif self.__options['loop'] < 0:
+			raise Exception('"loop" option cannot be negative')
+		if 'batch' not in self.__options:
+			self.__options['batch'] = True
+		elif type(self.__options['batch']) != bool:
+			raise Exception('"batch" option must be a boolean')
+		self.trajectory = Trajectory(path)
+		self.__step = 0
+
+	def seek(self, step: int) -> 'TrajectoryPlayer':
+		"""Move the player to a step of the trajectory
+		Args:
+			step (int): The step index
+		Returns:
+			TrajectoryPlayer: The player object
+		"""
+		if type(step) != int:
+			raise Exception('"step" must be an integer')
+		if step < 0 or step >= self.trajectory.steps:
+			raise Exception(f'"step" must be between 0 and {self.trajectory.steps - 1}')
+		self.__step = step
+		return self
+
+	def play(self) -> 'TrajectoryPlayer':
+		"""Play the trajectory from the current step, looping it the configured number of times (0 loops forever).
+		The full state of the trajectory is written at the first step of every loop, then only the changed channels.
+		Every loop ends on the last row of the trajectory, even when the rate skips over it.
+		Returns:
+			TrajectoryPlayer: The player object
+		"""
+		writer = coppelia.Batch(self._sim) if self.__options['batch'] else self._sim
+		setters = {'position': writer.setObjectPosition, 'rotation': writer.setObjectOrientation, 'angle': writer.setJointTargetPosition, 'quaternion': writer.setObjectQuaternion}
+		channels = [(setters[c['kind']], c['handle'], c['column'], c['column'] + c['size'], c['size'] == 1) for c in self.trajectory.channels]
+		data = self.trajectory.data
+		mask = self.trajectory.mask
+		steps = self.trajectory.steps
+		rate = self.__options['rate']
+		loops = self.__options['loop']
+		loop = 0
+		while loops == 0 or loop < loops:
+			first = self.__step
+			k = 0
+			row = first
+			previous = None
+			while row < steps:
+				if row != previous:
+					if previous is None:
+						written = range(len(channels))
+					else:
+						written = mask[previous + 1:row + 1].any(axis=0).nonzero()[0].tolist()
+					values = data[row]
+					for c in written:
+						setter, handle, begin, end, isScalar = channels[c]
+						setter(handle, float(values[begin]) if isScalar else values[begin:end].tolist())
+					previous = row
+				writer.step()
+				k += 1
+				row = first + int(k * rate)
+				if row >= steps and previous < steps - 1:
+					row = steps - 1
+			self.__step = 0
+			loop += 1
+		return self